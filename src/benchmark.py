@@ -0,0 +1,113 @@
+import argparse
+import tempfile
+import time
+import prompts
+from documents.chunking import SectionChunker
+from models.fake import FakeModel
+from prompts import PromptRequest, PromptHandler, PromptValidationHandler
+from prompts.deduplication import DeduplicationHandler
+from prompts.prefilter import LexicalIndex, LexicalPrefilter
+from prompts.topics import TopicsExtractionPrompt, TopicsValidationPrompt, TopicsBatchValidationPrompt
+from prompts.qa import QuestionAnswerExtractionPrompt, QuestionsValidationPrompt, AnswerValidationPrompt, \
+    QuestionsBatchValidationPrompt, AnswerBatchValidationPrompt
+from utils import read_json
+from utils.metrics import MetricsRecorder
+from utils.constants import SOURCE_DIR, SECTIONS_TO_IGNORE, CACHE_DIR
+
+parser = argparse.ArgumentParser(
+    description='Run the full prompt chain against the local fake model and report throughput.')
+parser.add_argument('--documents', help='documents.json to use instead of parsing the docx files')
+parser.add_argument('--target-tokens', type=int,
+                    help='split longer sections and merge shorter ones around this size')
+parser.add_argument('--limit', type=int, help='maximum number of sections')
+parser.add_argument('--batch-size', type=int, default=100)
+parser.add_argument('--max-batch-tokens', type=int, help='prompt token budget of each batch')
+parser.add_argument('--max-in-flight', type=int, default=4)
+parser.add_argument('--latency-mean', type=float, default=0.5)
+parser.add_argument('--latency-std', type=float, default=0.1)
+parser.add_argument('--failure-rate', type=float, default=0.05)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--no-streaming', action='store_true')
+parser.add_argument('--no-guided-decoding', action='store_true',
+                    help='do not constrain the responses to the JSON schema of each stage')
+parser.add_argument('--no-batch-validation', action='store_true',
+                    help='validate each topic, question and answer in its own prompt')
+parser.add_argument('--prefilter', action='store_true',
+                    help='decide the validations with a clear lexical score without the model')
+parser.add_argument('--dedup-threshold', type=float, default=0.8,
+                    help='similarity above which topics and questions are dropped, 0 to disable')
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.documents:
+        documents = read_json(args.documents)
+    else:
+        from documents import DocumentCollection
+        documents = DocumentCollection(
+            SOURCE_DIR, SECTIONS_TO_IGNORE, cache_dir=f'{CACHE_DIR}/documents').to_dict()
+
+    if args.target_tokens:
+        documents = SectionChunker(target_tokens=args.target_tokens).chunk(documents)
+
+    requests = [
+        PromptRequest.from_document(
+            metadata=dict(document_id=document['document_id'],
+                          section=document['section']),
+            document=document['content']
+        ) for document in documents[:args.limit]]
+
+    model = FakeModel(latency_mean=args.latency_mean, latency_std=args.latency_std,
+                      failure_rate=args.failure_rate, seed=args.seed, max_in_flight=args.max_in_flight)
+
+    if args.no_batch_validation:
+        handlers = [TopicsExtractionPrompt(model), TopicsValidationPrompt(model), QuestionAnswerExtractionPrompt(model),
+                    QuestionsValidationPrompt(model), AnswerValidationPrompt(model)]
+    else:
+        handlers = [TopicsExtractionPrompt(model), TopicsBatchValidationPrompt(model), QuestionAnswerExtractionPrompt(model),
+                    QuestionsBatchValidationPrompt(model), AnswerBatchValidationPrompt(model)]
+    if args.dedup_threshold > 0:
+        handlers.insert(1, DeduplicationHandler(model, 'topic', threshold=args.dedup_threshold))
+        handlers.insert(4, DeduplicationHandler(model, 'question', threshold=args.dedup_threshold))
+    for handler, next_handler in zip(handlers, handlers[1:]):
+        handler.set_next(next_handler)
+    prefilter = LexicalPrefilter(LexicalIndex([document['content'] for document in documents])) \
+        if args.prefilter else None
+    for handler in handlers:
+        handler.max_batch_tokens = args.max_batch_tokens
+        handler.guided_decoding = not args.no_guided_decoding
+        if isinstance(handler, PromptValidationHandler):
+            handler.prefilter = prefilter
+
+    PromptHandler.metrics = MetricsRecorder()
+
+    with tempfile.TemporaryDirectory() as checkpoints_dir:
+        prompts.CHECKPOINTS_DIR = checkpoints_dir
+        start = time.monotonic()
+        qa_dataset = handlers[0].handle(requests, batch_size=args.batch_size,
+                                        streaming=not args.no_streaming)
+        duration = time.monotonic() - start
+
+    generation_time = model.get_generation_time()
+
+    print(f"{'stage':<24}{'requests':>10}{'retries':>10}{'errors':>10}{'repairs':>10}{'dropped':>10}")
+    for handler in handlers:
+        repairs = sum(count for name, count in handler.stats.items()
+                      if name.startswith('repair_'))
+        print(f"{handler.get_prompt_template().name:<24}{handler.stats['requests']:>10}"
+              f"{handler.stats['retries']:>10}{handler.stats['errors']:>10}{repairs:>10}"
+              f"{handler.stats['dropped']:>10}")
+    print()
+    print(f"Sections: {len(requests)}, QA pairs: {len(qa_dataset)}")
+    print(f"Model calls: {model.calls}, prompts: {model.prompts}")
+    print(f"Wall-clock: {duration:.2f}s, sections/s: {len(requests) / duration:.2f}, "
+          f"prompts/s: {model.prompts / duration:.2f}")
+    print(f"Generation time: {generation_time:.2f}s, "
+          f"client-side overhead: {duration - generation_time:.2f}s")
+    print()
+    print(PromptHandler.metrics.format_summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,20 @@
-from docx import Document as Docx
-from docx.text.paragraph import Paragraph
-from docx.shared import Pt
+from .reader import DocxReader, DocxParagraph
 import re
 import os
 import json
 import uuid
+import hashlib
+from pathlib import Path
 from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+
+# Changes whenever the format of the cached documents changes
+CACHE_VERSION = '2'
+
 
 class Document():
     def __init__(self, file_path: str, sections_to_ignore: list[str] = []):
-        self.document = Docx(file_path)
+        self.reader = DocxReader(file_path)
         self.file_path = file_path
         self.filename = os.path.basename(file_path)
         self.initial_heading = "TITLE"
@@ -18,11 +23,23 @@ class Document():
         self.__set_id()
 
     def __set_id(self):
-        if (not self.document.core_properties.identifier):
-            self.document.core_properties.identifier = uuid.uuid4()
-            self.document.save(self.file_path)
-
-        self.id = self.document.core_properties.identifier
+        # Documents without an identifier get one derived from the file name, so the
+        # source file is never modified and the id is stable across edits
+        self.id = self.reader.get_identifier() or _get_derived_id(self.filename)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Document':
+        document = cls.__new__(cls)
+        document.file_path = data['file_path']
+        document.filename = data['filename']
+        document.id = data['id']
+        document.content = data['content']
+        document.parents = data['parents']
+        return document
+
+    def as_dict(self) -> dict:
+        return dict(file_path=self.file_path, filename=self.filename,
+                    id=self.id, content=self.content, parents=self.parents)
 
     def get_content(self) -> dict:
         return self.content
@@ -41,39 +58,46 @@ class Document():
         for section in self.__get_sections():
             output.append(dict(
                 document_id=self.id,
+                section_id=self.__get_section_id(section),
                 filename=self.get_filename(),
                 section=section,
+                parent_section=self.parents.get(section),
                 content=" ".join(self.content[section]))
             )
         return output
 
+    def __get_section_id(self, section: str) -> str:
+        """Content-addressed id, changing only when the section title or content changes."""
+        content = json.dumps([self.id, section, self.content[section]],
+                             ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
     def __extract_contents(self):
         self.content = {}
+        self.parents = {}
         current_heading = self.initial_heading
-
-        for section in self.document.sections:
-            header_paragraphs = section.header.paragraphs
-            footer_paragraphs = section.footer.paragraphs
-
-            for item in section.iter_inner_content():
-                if (not isinstance(item, Paragraph)):
-                    continue
-
-                text = self.__parse_text(item.text)
-                if (len(text) == 0):
-                    continue
-                if (item in header_paragraphs or item in footer_paragraphs):
-                    continue
-                if (self.__has_small_font(item)):
-                    continue
-
-                if (self.__is_heading(item)):
-                    current_heading = text
-
-                section_content = self.content.setdefault(current_heading, [])
-
-                if text != current_heading:
-                    section_content.append(self.__parse_section_content(text))
+        headings = []
+
+        for paragraph in self.reader.iter_paragraphs():
+            text = self.__parse_text(paragraph.text)
+            if (len(text) == 0):
+                continue
+            if (self.__has_small_font(paragraph)):
+                continue
+
+            if (self.__is_heading(paragraph)):
+                current_heading = text
+                level = self.__get_heading_level(paragraph)
+                headings = [(heading_level, heading) for heading_level, heading in headings
+                            if heading_level < level]
+                if len(headings) > 0:
+                    self.parents.setdefault(text, headings[-1][1])
+                headings.append((level, text))
+
+            section_content = self.content.setdefault(current_heading, [])
+
+            if text != current_heading:
+                section_content.append(self.__parse_section_content(text))
         self.__remove_invalid_sections()
 
     def __parse_section_content(self, text: str) -> str:
@@ -88,34 +112,79 @@ class Document():
             if section in self.sections_to_ignore or section_content_length == 0:
                 self.content.pop(section)
 
-    def __has_small_font(self, paragraph: Paragraph):
-        font_size = paragraph.style.font.size
-
-        if (self.__assert_font_size(font_size)):
+    def __has_small_font(self, paragraph: DocxParagraph):
+        if (paragraph.style and self.__assert_font_size(paragraph.style.font_size)):
             return True
 
-        for run in paragraph.runs:
-            if (self.__assert_font_size(run.font.size)):
+        for font_size in paragraph.run_font_sizes:
+            if (self.__assert_font_size(font_size)):
                 return True
 
         return False
 
-    def __assert_font_size(self, font_size: Pt):
-        return font_size == Pt(9) or font_size == Pt(8)
+    def __assert_font_size(self, font_size: int):
+        # Font sizes are in half-points
+        return font_size == 18 or font_size == 16
 
-    def __is_heading(self, paragraph: Paragraph):
-        return paragraph.style.name.startswith('Heading')
+    def __is_heading(self, paragraph: DocxParagraph):
+        return paragraph.style is not None and paragraph.style.name.startswith('Heading')
+
+    def __get_heading_level(self, paragraph: DocxParagraph) -> int:
+        level = re.search(r'\d+', paragraph.style.name)
+        return int(level.group()) if level else 1
 
     def __parse_text(self, text: str):
         text = re.sub('\s+', ' ', text).strip()
         return '' if text.isnumeric() else text
 
 
+def load_document(file_path: str, sections_to_ignore: list[str], cache_dir: str = None) -> dict:
+    """Parse a document, reusing the sections extracted from a file with the same content."""
+    if cache_dir is None:
+        return Document(file_path, list(sections_to_ignore)).as_dict()
+
+    cache_file = f'{cache_dir}/{_get_cache_key(file_path, sections_to_ignore)}.json'
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r', encoding='utf-8') as fp:
+            document = json.load(fp)
+        # the cached file may have had another name, which the derived identifiers depend on
+        filename = os.path.basename(file_path)
+        if document['id'] == _get_derived_id(document['filename']):
+            document['id'] = _get_derived_id(filename)
+        return {**document, 'file_path': file_path, 'filename': filename}
+
+    document = Document(file_path, list(sections_to_ignore)).as_dict()
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with open(cache_file, 'w', encoding='utf-8') as fp:
+        json.dump(document, fp, ensure_ascii=False)
+    return document
+
+
+def _get_derived_id(filename: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, filename))
+
+
+def _get_cache_key(file_path: str, sections_to_ignore: list[str]) -> str:
+    digest = hashlib.sha256(CACHE_VERSION.encode('utf-8'))
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    digest.update(json.dumps(sorted(sections_to_ignore),
+                  ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
 class DocumentCollection():
-    def __init__(self, dir_path: str, sections_to_ignore: list[str] = []) -> None:
-        files = os.listdir(dir_path)
-        self.documents = [Document(f'{dir_path}/{file_name}', sections_to_ignore)
-                          for file_name in files]
+    def __init__(self, dir_path: str, sections_to_ignore: list[str] = [], cache_dir: str = None,
+                 max_workers: int = None) -> None:
+        files = sorted(os.listdir(dir_path))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(load_document, f'{dir_path}/{file_name}',
+                                       list(sections_to_ignore), cache_dir)
+                       for file_name in files]
+            self.documents = [Document.from_dict(future.result())
+                              for future in futures]
 
     def get_documents(self) -> list[Document]:
         return self.documents
@@ -0,0 +1,86 @@
+import hashlib
+import re
+from typing import Callable
+from utils import estimate_tokens
+
+
+class SectionChunker:
+    """Evens out the size of the sections sent to the prompts: sections longer
+    than 'target_tokens' are split into overlapping chunks, and adjacent
+    sections shorter than 'min_tokens' under the same parent heading are merged."""
+
+    def __init__(self, target_tokens: int = 1024, overlap_tokens: int = 128, min_tokens: int = 128,
+                 count_tokens: Callable[[str], int] = estimate_tokens) -> None:
+        self._target_tokens = target_tokens
+        self._overlap_tokens = overlap_tokens
+        self._min_tokens = min_tokens
+        self._count_tokens = count_tokens
+
+    def chunk(self, sections: list[dict]) -> list[dict]:
+        output = []
+        for section in self.__merge(sections):
+            output.extend(self.__split(section))
+        return output
+
+    def __merge(self, sections: list[dict]) -> list[dict]:
+        output = []
+        for section in sections:
+            previous = output[-1] if len(output) > 0 else None
+            if previous is not None and self.__can_merge(previous, section):
+                output[-1] = self.__merge_sections(previous, section)
+            else:
+                output.append(section)
+        return output
+
+    def __can_merge(self, previous: dict, section: dict) -> bool:
+        if previous['document_id'] != section['document_id'] or previous.get('parent_section') is None \
+                or previous.get('parent_section') != section.get('parent_section'):
+            return False
+
+        previous_tokens = self._count_tokens(previous['content'])
+        tokens = self._count_tokens(section['content'])
+        is_small = previous_tokens < self._min_tokens or tokens < self._min_tokens
+        return is_small and previous_tokens + tokens <= self._target_tokens
+
+    def __merge_sections(self, previous: dict, section: dict) -> dict:
+        return {**previous,
+                'section_id': self.__get_id(previous['section_id'], section['section_id']),
+                'section': f"{previous['section']} / {section['section']}",
+                'content': f"{previous['content']} {section['content']}"}
+
+    def __split(self, section: dict) -> list[dict]:
+        if self._count_tokens(section['content']) <= self._target_tokens:
+            return [section]
+
+        sentences = re.split(r'(?<=[.!?;:])\s+', section['content'])
+        chunks = []
+        chunk = []
+        chunk_tokens = 0
+        for sentence in sentences:
+            tokens = self._count_tokens(sentence)
+            if len(chunk) > 0 and chunk_tokens + tokens > self._target_tokens:
+                chunks.append(chunk)
+                chunk = self.__get_overlap(chunk)
+                chunk_tokens = sum(self._count_tokens(item) for item in chunk)
+            chunk.append(sentence)
+            chunk_tokens += tokens
+        chunks.append(chunk)
+
+        return [{**section,
+                 'section_id': self.__get_id(section['section_id'], str(i)),
+                 'section': f"{section['section']} ({i}/{len(chunks)})",
+                 'content': " ".join(chunk)}
+                for i, chunk in enumerate(chunks, start=1)]
+
+    def __get_overlap(self, chunk: list[str]) -> list[str]:
+        overlap = []
+        overlap_tokens = 0
+        for sentence in reversed(chunk[1:]):
+            overlap_tokens += self._count_tokens(sentence)
+            if overlap_tokens > self._overlap_tokens:
+                break
+            overlap.insert(0, sentence)
+        return overlap
+
+    def __get_id(self, *ids: str) -> str:
+        return hashlib.sha256(':'.join(ids).encode('utf-8')).hexdigest()[:16]
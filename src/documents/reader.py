@@ -0,0 +1,146 @@
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass
+from typing import Iterator
+from xml.etree import ElementTree
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+RUN_TEXT = {
+    f'{W}tab': '\t',
+    f'{W}ptab': '\t',
+    f'{W}cr': '\n',
+    f'{W}noBreakHyphen': '-',
+}
+
+
+@dataclass
+class Style:
+    name: str
+    font_size: int
+
+
+@dataclass
+class DocxParagraph:
+    text: str
+    style: Style
+    run_font_sizes: list[int]
+
+
+class DocxReader:
+    """Reads the body paragraphs of a .docx file in a single streaming pass over
+    its XML, without building the python-docx object graph.
+    Font sizes are in half-points, as stored in the document."""
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+
+    def get_identifier(self) -> str:
+        with zipfile.ZipFile(self.file_path) as archive:
+            if 'docProps/core.xml' not in archive.namelist():
+                return None
+            with archive.open('docProps/core.xml') as fp:
+                identifier = ElementTree.parse(fp).find(f'{DC}identifier')
+        return identifier.text if identifier is not None else None
+
+    def iter_paragraphs(self) -> Iterator[DocxParagraph]:
+        with zipfile.ZipFile(self.file_path) as archive:
+            document_part = self.__get_target(archive, '_rels/.rels', 'officeDocument') \
+                or 'word/document.xml'
+            styles, default_style = self.__read_styles(archive, document_part)
+
+            with archive.open(document_part) as fp:
+                depth = 0
+                body = None
+                for event, element in ElementTree.iterparse(fp, events=('start', 'end')):
+                    if event == 'start':
+                        depth += 1
+                        if depth == 2 and element.tag == f'{W}body':
+                            body = element
+                        continue
+
+                    depth -= 1
+                    if depth != 2 or body is None:
+                        continue
+
+                    if element.tag == f'{W}p':
+                        yield self.__read_paragraph(element, styles, default_style)
+                    body.remove(element)
+
+    def __read_paragraph(self, paragraph: ElementTree.Element, styles: dict[str, Style],
+                         default_style: Style) -> DocxParagraph:
+        style_id = paragraph.find(f'{W}pPr/{W}pStyle')
+        style = styles.get(style_id.get(f'{W}val')) if style_id is not None else None
+
+        text = []
+        run_font_sizes = []
+        for child in paragraph:
+            if child.tag == f'{W}r':
+                run_font_sizes.append(self.__read_font_size(child))
+                text.append(self.__read_run_text(child))
+            elif child.tag == f'{W}hyperlink':
+                text.extend(self.__read_run_text(run)
+                            for run in child.iterfind(f'{W}r'))
+
+        return DocxParagraph(''.join(text), style or default_style, run_font_sizes)
+
+    def __read_run_text(self, run: ElementTree.Element) -> str:
+        text = []
+        for child in run:
+            if child.tag == f'{W}t':
+                text.append(child.text or '')
+            elif child.tag == f'{W}br':
+                break_type = child.get(f'{W}type', 'textWrapping')
+                text.append('\n' if break_type == 'textWrapping' else '')
+            else:
+                text.append(RUN_TEXT.get(child.tag, ''))
+        return ''.join(text)
+
+    def __read_font_size(self, element: ElementTree.Element) -> int:
+        size = element.find(f'{W}rPr/{W}sz')
+        value = size.get(f'{W}val') if size is not None else None
+        return int(value) if value is not None and value.isdigit() else None
+
+    def __read_styles(self, archive: zipfile.ZipFile, document_part: str) -> tuple[dict[str, Style], Style]:
+        rels_part = posixpath.join(posixpath.dirname(document_part), '_rels',
+                                   f'{posixpath.basename(document_part)}.rels')
+        styles_part = self.__get_target(archive, rels_part, 'styles')
+        if styles_part is None:
+            return {}, None
+
+        styles = {}
+        default_style = None
+        with archive.open(styles_part) as fp:
+            for element in ElementTree.parse(fp).getroot().iterfind(f'{W}style'):
+                if element.get(f'{W}type') != 'paragraph':
+                    continue
+                name = element.find(f'{W}name')
+                style = Style(
+                    name=self.__get_ui_name(
+                        name.get(f'{W}val') if name is not None else ''),
+                    font_size=self.__read_font_size(element))
+                styles[element.get(f'{W}styleId')] = style
+                if element.get(f'{W}default') in ('1', 'true', 'on'):
+                    default_style = style
+        return styles, default_style
+
+    def __get_ui_name(self, name: str) -> str:
+        # Word stores the built-in heading styles with lowercase names
+        return re.sub(r'^heading (\d)$', r'Heading \1', name)
+
+    def __get_target(self, archive: zipfile.ZipFile, rels_part: str, relationship_type: str) -> str:
+        if rels_part not in archive.namelist():
+            return None
+        with archive.open(rels_part) as fp:
+            for relationship in ElementTree.parse(fp).getroot().iterfind(f'{RELATIONSHIPS}Relationship'):
+                if relationship.get('Type', '').endswith(f'/{relationship_type}') \
+                        and relationship.get('TargetMode') != 'External':
+                    target = relationship.get('Target')
+                    if target.startswith('/'):
+                        return target[1:]
+                    base_dir = posixpath.dirname(posixpath.dirname(rels_part))
+                    return posixpath.normpath(posixpath.join(base_dir, target))
+        return None
@@ -1,36 +1,213 @@
+import argparse
+import glob
+import os
+import time
+from pathlib import Path
 from documents import DocumentCollection
+from documents.chunking import SectionChunker
 from utils.constants import SECTIONS_TO_IGNORE
 from models.factory import ModelFactory
-from prompts.topics import TopicsExtractionPrompt, TopicsValidationPrompt
-from prompts.qa import QuestionAnswerExtractionPrompt, QuestionsValidationPrompt, AnswerValidationPrompt
-from prompts import PromptRequest
-from utils import config_log, save_json
-from utils.constants import SOURCE_DIR, OUTPUT_DIR
+from prompts.topics import TopicsExtractionPrompt, TopicsBatchValidationPrompt
+from prompts.qa import QuestionAnswerExtractionPrompt, QuestionsBatchValidationPrompt, AnswerBatchValidationPrompt
+from prompts import PromptRequest, PromptHandler
+from prompts.deduplication import DeduplicationHandler
+from prompts.prefilter import LexicalIndex, LexicalPrefilter
+from prompts.planner import RunPlanner, format_plan
+from models.tokenizer import count_tokens
+from utils import config_log, save_json, read_json, read_jsonl, JsonlWriter
+from utils.metrics import MetricsRecorder
+from utils.constants import SOURCE_DIR, OUTPUT_DIR, CACHE_DIR
 
-logger = config_log()
+parser = argparse.ArgumentParser()
+parser.add_argument('--resume', action='store_true',
+                    help='skip requests already processed in a previous run')
+parser.add_argument('--local', action='store_true',
+                    help='use the local fake model instead of the Modal deployment')
+parser.add_argument('--incremental', action='store_true',
+                    help='only process new or changed sections, reusing the QA of unchanged ones')
+parser.add_argument('--target-tokens', type=int, default=1024,
+                    help='split longer sections and merge shorter ones around this size, 0 to disable')
+parser.add_argument('--endpoint',
+                    help='base URL of an OpenAI-compatible server to use instead of the Modal deployment, e.g. http://localhost:8000/v1')
+parser.add_argument('--endpoint-model', default='internlm/internlm2-chat-7b',
+                    help='model name sent to the OpenAI-compatible server')
+parser.add_argument('--stage-model', action='append', default=[], metavar='STAGE=MODEL',
+                    help="model of a stage (topics, questions, topics_validation, questions_validation, "
+                         "answers_validation) or of all the 'extraction' or 'validation' stages: "
+                         "'local', 'modal' or the URL of an OpenAI-compatible server, optionally "
+                         "followed by '#<model name>'. Can be repeated")
+parser.add_argument('--redeploy', action='store_true',
+                    help='deploy the Modal app even when the deployed one is up to date')
+parser.add_argument('--prefilter', nargs='+', default=[], metavar='STAGE',
+                    choices=['topics_validation', 'questions_validation', 'answers_validation'],
+                    help='validation stages where the items clearly related or unrelated to their section '
+                         'by lexical score are decided without the model')
+parser.add_argument('--prefilter-accept', type=float, default=0.9,
+                    help='lexical score from which the pre-filter accepts an item')
+parser.add_argument('--prefilter-reject', type=float, default=0.0,
+                    help='lexical score below which the pre-filter rejects an item, 0 to never reject')
+parser.add_argument('--dedup-threshold', type=float, default=0.8,
+                    help='drop topics and questions at least this similar to a previous one of the section, '
+                         '0 to disable')
+parser.add_argument('--batch-size', type=int, default=100,
+                    help='number of requests sent to the model in each batch')
+parser.add_argument('--max-batch-tokens', action='append', default=[], metavar='STAGE=TOKENS',
+                    help="prompt and completion token budget of each batch of a stage, or of all the "
+                         "'extraction' or 'validation' stages. Can be repeated")
+parser.add_argument('--dry-run', action='store_true',
+                    help='estimate the requests, tokens and GPU time of each stage without calling the models')
+parser.add_argument('--prefill-tokens-per-second', type=float, default=8000,
+                    help='prompt tokens processed per second by a GPU, used by --dry-run')
+parser.add_argument('--decode-tokens-per-second', type=float, default=1500,
+                    help='completion tokens generated per second by a GPU, used by --dry-run')
+parser.add_argument('--gpu-cost-per-hour', type=float,
+                    help='cost of a GPU-hour, to estimate the cost of the run with --dry-run')
 
-collection = DocumentCollection(SOURCE_DIR, SECTIONS_TO_IGNORE)
+STAGE_GROUPS = dict(topics='extraction', questions='extraction', topics_validation='validation',
+                    questions_validation='validation', answers_validation='validation')
 
-collection.save(OUTPUT_DIR)
 
-model = ModelFactory.create(local=False)
+def parse_stage_assignments(option: str, assignments: list[str], value_name: str) -> dict[str, str]:
+    """Value of each stage assigned with 'option', given for the stage itself or for its group."""
+    if any('=' not in assignment for assignment in assignments):
+        parser.error(f"{option} expects STAGE={value_name}")
+    values = dict(assignment.split('=', 1) for assignment in assignments)
+    unknown_stages = set(values) - set(STAGE_GROUPS) - set(STAGE_GROUPS.values())
+    if unknown_stages:
+        parser.error(f"unknown stage(s) in {option}: {', '.join(sorted(unknown_stages))}")
+    return {stage: values.get(stage, values.get(group)) for stage, group in STAGE_GROUPS.items()
+            if stage in values or group in values}
 
-requests = [
-    PromptRequest(
-        metadata=dict(document_id=document['document_id'],
-                      section=document['section']),
-        data=dict(document=document['content'])
-    ) for document in collection.to_dict()]
 
-logger.info(f"Processing {len(requests)} requests")
+def main():
+    args = parser.parse_args()
 
-prompt = TopicsExtractionPrompt(model)
-prompt.set_next(TopicsValidationPrompt(model)) \
-    .set_next(QuestionAnswerExtractionPrompt(model)) \
-    .set_next(QuestionsValidationPrompt(model)) \
-    .set_next(AnswerValidationPrompt(model))
+    stage_model_specs = parse_stage_assignments('--stage-model', args.stage_model, 'MODEL')
+    try:
+        stage_max_batch_tokens = {stage: int(tokens) for stage, tokens in
+                                  parse_stage_assignments('--max-batch-tokens', args.max_batch_tokens,
+                                                          'TOKENS').items()}
+    except ValueError:
+        parser.error("--max-batch-tokens expects an integer number of tokens")
 
-qa_dataset = prompt.handle(requests, batch_size=100)
+    logger = config_log()
 
-filename = 'vehicle_repair_and_maintenance_qa.json'
-save_json(f'{OUTPUT_DIR}/{filename}', qa_dataset, append=True)
+    default_model_spec = 'local' if args.local else args.endpoint or 'modal'
+    stage_specs = {stage: stage_model_specs.get(stage, default_model_spec) for stage in STAGE_GROUPS}
+    if args.dry_run:
+        # named after the configured models, without deploying or connecting to them
+        models = {spec: ModelFactory.create_placeholder(spec, args.endpoint_model)
+                  for spec in dict.fromkeys(stage_specs.values())}
+    else:
+        models = ModelFactory.create_all(list(stage_specs.values()), redeploy=args.redeploy,
+                                         endpoint_model=args.endpoint_model)
+    stage_models = {stage: models[spec] for stage, spec in stage_specs.items()}
+    for spec, model in models.items():
+        logger.info(
+            f"Model '{model.model_name}' ({spec}): {', '.join(stage for stage in stage_specs if stage_specs[stage] == spec)}")
+        # containers start loading the model while the documents are parsed
+        model.prewarm()
+
+    collection = DocumentCollection(
+        SOURCE_DIR, SECTIONS_TO_IGNORE, cache_dir=f'{CACHE_DIR}/documents')
+
+    collection.save(OUTPUT_DIR)
+
+    filename = 'vehicle_repair_and_maintenance_qa.jsonl'
+    dataset_file = f'{OUTPUT_DIR}/{filename}'
+    processed_sections_file = f'{OUTPUT_DIR}/processed_sections.json'
+    metrics_dir = f'{OUTPUT_DIR}/metrics'
+
+    documents = collection.to_dict()
+    if args.target_tokens > 0:
+        documents = SectionChunker(target_tokens=args.target_tokens,
+                                   count_tokens=stage_models['topics'].count_tokens).chunk(documents)
+    section_ids = set(document['section_id'] for document in documents)
+    # built from all the sections, incremental runs included, for stable term statistics
+    prefilter = LexicalPrefilter(LexicalIndex([document['content'] for document in documents]),
+                                 accept_above=args.prefilter_accept,
+                                 reject_below=args.prefilter_reject) if len(args.prefilter) > 0 else None
+
+    if args.incremental:
+        processed_section_ids = set(read_json(processed_sections_file)) \
+            if os.path.isfile(processed_sections_file) else set()
+        documents = [document for document in documents
+                     if document['section_id'] not in processed_section_ids]
+
+    requests = [
+        PromptRequest.from_document(
+            metadata=dict(document_id=document['document_id'],
+                          section_id=document['section_id'],
+                          section=document['section']),
+            document=document['content']
+        ) for document in documents]
+
+    logger.info(f"Processing {len(requests)} requests")
+
+    validation_prompts = [TopicsBatchValidationPrompt(stage_models['topics_validation']),
+                          QuestionsBatchValidationPrompt(stage_models['questions_validation']),
+                          AnswerBatchValidationPrompt(stage_models['answers_validation'])]
+    for validation_prompt in validation_prompts:
+        if validation_prompt.get_prompt_template().name in args.prefilter:
+            validation_prompt.prefilter = prefilter
+
+    handlers = [TopicsExtractionPrompt(stage_models['topics']), validation_prompts[0],
+                QuestionAnswerExtractionPrompt(stage_models['questions']), validation_prompts[1],
+                validation_prompts[2]]
+    if args.dedup_threshold > 0:
+        handlers.insert(1, DeduplicationHandler(stage_models['topics'], 'topic', threshold=args.dedup_threshold))
+        handlers.insert(4, DeduplicationHandler(stage_models['questions'], 'question',
+                                                threshold=args.dedup_threshold))
+    for handler, next_handler in zip(handlers, handlers[1:]):
+        handler.set_next(next_handler)
+    for handler in handlers:
+        handler.max_batch_tokens = stage_max_batch_tokens.get(handler.get_prompt_template().name)
+    prompt = handlers[0]
+
+    if args.dry_run:
+        history = MetricsRecorder.load(sorted(glob.glob(f'{metrics_dir}/metrics_*.jsonl')))
+        plans = RunPlanner(count_tokens, history).plan(prompt, requests)
+        plan_summary = format_plan(plans, args.batch_size, args.prefill_tokens_per_second,
+                                   args.decode_tokens_per_second, args.gpu_cost_per_hour)
+        logger.info(f"Estimated requests, tokens and GPU time per stage:\n{plan_summary}")
+        return
+
+    # the dataset is rewritten to a temporary file, replacing the previous one at the end, when
+    # it keeps the QA of unchanged sections or when the stored results are yielded again on resume
+    rewrite_dataset = args.incremental or args.resume
+    if rewrite_dataset:
+        dataset_writer = JsonlWriter(f'{dataset_file}.tmp', append=False)
+        if args.incremental:
+            if os.path.isfile(dataset_file):
+                for qa in read_jsonl(dataset_file):
+                    if qa['metadata'].get('section_id') in section_ids:
+                        dataset_writer.write([qa])
+            logger.info(
+                f"Reusing {dataset_writer.count} QA pair(s) of unchanged sections")
+    else:
+        dataset_writer = JsonlWriter(dataset_file)
+
+    Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+    PromptHandler.metrics = MetricsRecorder(
+        f'{metrics_dir}/metrics_{time.strftime("%Y%m%d-%H%M%S")}.jsonl')
+
+    with dataset_writer:
+        if len(requests) > 0:
+            for qa in prompt.stream(requests, batch_size=args.batch_size, resume=args.resume):
+                dataset_writer.write([qa.resolved()])
+
+    if rewrite_dataset:
+        if os.path.isfile(dataset_writer.file):
+            os.replace(dataset_writer.file, dataset_file)
+        elif os.path.isfile(dataset_file):
+            os.remove(dataset_file)
+
+    save_json(processed_sections_file, sorted(section_ids))
+
+    PromptHandler.metrics.close()
+    PromptHandler.metrics.write_prometheus(f'{metrics_dir}/auto_qa.prom')
+    logger.info(f"Metrics per stage and model:\n{PromptHandler.metrics.format_summary()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,57 @@
+from dataclasses import dataclass, field
+from utils import estimate_tokens
+
+
+@dataclass
+class GenerationConfig:
+    max_tokens: int = 2048
+    temperature: float = 0.7
+    top_p: float = 0.9
+    stop: list[str] = field(default_factory=list)
+    # JSON schema used to constrain the output when the backend supports guided decoding
+    json_schema: dict = None
+
+
+class Completion(str):
+    """Generated text carrying the token usage reported by the backend and
+    whether it was served from a cache."""
+
+    def __new__(cls, text: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached: bool = False):
+        completion = super().__new__(cls, text)
+        completion.prompt_tokens = prompt_tokens
+        completion.completion_tokens = completion_tokens
+        completion.cached = cached
+        return completion
+
+
 class IModel:
-    def __init__(self, model_name: str) -> None:
+    def __init__(self, model_name: str, max_in_flight: int = 1) -> None:
         self.model_name = model_name
+        self.max_in_flight = max_in_flight
         self.lodal_model()
 
     """Load model parameters to be able to execute 'generate' method."""
     def lodal_model(self) -> None:
         pass
 
-    """Generate a list of responses given a system prompt and multiple user prompts."""
-    def generate(self, system_prompt: str, user_prompts: list[str]) -> list[str]:
+    """Start loading the model in the background, so the first requests do not wait for it."""
+    def prewarm(self) -> None:
+        pass
+
+    """Return the model that should be used by callers opting out of response caching."""
+    def without_cache(self) -> 'IModel':
+        return self
+
+    """Discard stored responses for prompts whose response could not be used."""
+    def discard(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> None:
+        pass
+
+    """Count the tokens of a text, used to build batches under a token budget."""
+    def count_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    """Generate a list of responses given a system prompt, multiple user prompts and
+    the generation settings, using the default GenerationConfig when not informed.
+    Backends reporting token usage return Completion instances."""
+    def generate(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> list[str]:
         pass
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from dataclasses import asdict
+from . import IModel, GenerationConfig, Completion
+
+
+class CachedModel(IModel):
+    """Disk-backed response cache in front of any IModel, evicting the least
+    recently used responses once the cache grows beyond max_size_bytes."""
+
+    def __init__(self, model: IModel, file: str, max_size_bytes: int = 1024 ** 3) -> None:
+        super().__init__(model.model_name, model.max_in_flight)
+        self._model = model
+        self._max_size_bytes = max_size_bytes
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        Path(file).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(file, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL)""")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def without_cache(self) -> IModel:
+        return self._model.without_cache()
+
+    def prewarm(self) -> None:
+        self._model.prewarm()
+
+    def count_tokens(self, text: str) -> int:
+        return self._model.count_tokens(text)
+
+    def discard(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> None:
+        keys = [(self.__get_key(system_prompt, user_prompt, config),)
+                for user_prompt in user_prompts]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM responses WHERE key = ?", keys)
+        self._model.discard(system_prompt, user_prompts, config)
+
+    def generate(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> list[str]:
+        keys = [self.__get_key(system_prompt, user_prompt, config)
+                for user_prompt in user_prompts]
+        cached_responses = self.__get(keys)
+
+        missing_indexes = [i for i, key in enumerate(keys)
+                           if key not in cached_responses]
+        with self._lock:
+            self.hits += len(keys) - len(missing_indexes)
+            self.misses += len(missing_indexes)
+
+        responses = [cached_responses.get(key) for key in keys]
+        if len(missing_indexes) > 0:
+            generated_responses = self._model.generate(
+                system_prompt, [user_prompts[i] for i in missing_indexes], config)
+            for i, response in zip(missing_indexes, generated_responses):
+                responses[i] = response
+            self.__put({keys[i]: responses[i] for i in missing_indexes})
+
+        self._logger.debug(
+            f"Cache hits: {self.hits}, misses: {self.misses}")
+        return responses
+
+    def __get_key(self, system_prompt: str, user_prompt: str, config: GenerationConfig) -> str:
+        config = config or GenerationConfig()
+        content = json.dumps([self.model_name, system_prompt, user_prompt, asdict(config)],
+                             ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def __get(self, keys: list[str]) -> dict[str, str]:
+        responses = {}
+        now = time.time()
+        with self._lock, self._connection:
+            for key in keys:
+                row = self._connection.execute(
+                    "SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row:
+                    responses[key] = Completion(row[0], cached=True)
+                    self._connection.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return responses
+
+    def __put(self, responses: dict[str, str]) -> None:
+        now = time.time()
+        rows = [(key, response, len(response.encode('utf-8')), now)
+                for key, response in responses.items() if response is not None]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)", rows)
+            self.__evict()
+
+    def __evict(self) -> None:
+        total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self._max_size_bytes:
+            return
+
+        rows = self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if total_size <= self._max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self._connection.executemany(
+            "DELETE FROM responses WHERE key = ?", evicted_keys)
+        self._logger.info(f"Evicted {len(evicted_keys)} cached response(s)")
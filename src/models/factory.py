@@ -1,10 +1,74 @@
-from .internlm import InternLM
+import os
+from .cache import CachedModel
+from .fake import FakeModel, MODEL_NAME as FAKE_MODEL_NAME
+from .openai_compatible import OpenAICompatibleModel
+from .tokenizer import MODEL_NAME as INTERNLM_MODEL_NAME, count_tokens
 from . import IModel
+from utils.constants import CACHE_DIR
+
+DEFAULT_ENDPOINT_MODEL = "internlm/internlm2-chat-7b"
+
+
+class PlaceholderModel(IModel):
+    """Stands for a model when planning runs, with its name and token counting but no generation."""
+
+    def __init__(self, model_name: str, count_tokens=None) -> None:
+        self._count_tokens = count_tokens
+        super().__init__(model_name)
+
+    def count_tokens(self, text: str) -> int:
+        if self._count_tokens is None:
+            return super().count_tokens(text)
+        return self._count_tokens(text)
 
 
 class ModelFactory:
     @staticmethod
-    def create(local=False) -> IModel:
-        if not local:
-            return InternLM()
-        pass
+    def create(local=False, cache=True, redeploy=False, endpoint: str = None,
+               endpoint_model: str = DEFAULT_ENDPOINT_MODEL) -> IModel:
+        """Create the fake model when 'local' is set, a client of the OpenAI-compatible
+        server at 'endpoint' when informed, or the model deployed on Modal otherwise."""
+        if local:
+            return FakeModel()
+
+        if endpoint:
+            model = OpenAICompatibleModel(endpoint, endpoint_model,
+                                          api_key=os.environ.get('OPENAI_API_KEY'))
+        else:
+            from .internlm import InternLM
+            model = InternLM(redeploy=redeploy)
+        if cache:
+            model = CachedModel(model, f'{CACHE_DIR}/responses.db')
+        return model
+
+    @staticmethod
+    def create_from_spec(spec: str, cache=True, redeploy=False,
+                         endpoint_model: str = DEFAULT_ENDPOINT_MODEL) -> IModel:
+        """Create the model described by 'spec': 'local', 'modal' or the URL of an
+        OpenAI-compatible server, optionally followed by '#<model name>'."""
+        if spec == 'local':
+            return ModelFactory.create(local=True)
+        if spec == 'modal':
+            return ModelFactory.create(cache=cache, redeploy=redeploy)
+        if not spec.startswith(('http://', 'https://')):
+            raise ValueError(f"Invalid model '{spec}', expected 'local', 'modal' or an URL")
+        endpoint, _, model_name = spec.partition('#')
+        return ModelFactory.create(cache=cache, endpoint=endpoint,
+                                   endpoint_model=model_name or endpoint_model)
+
+    @staticmethod
+    def create_placeholder(spec: str, endpoint_model: str = DEFAULT_ENDPOINT_MODEL) -> IModel:
+        """Model named after the one described by 'spec', without deploying or connecting
+        to it, used to plan runs."""
+        if spec == 'local':
+            return PlaceholderModel(FAKE_MODEL_NAME)
+        if spec == 'modal':
+            return PlaceholderModel(INTERNLM_MODEL_NAME, count_tokens)
+        if not spec.startswith(('http://', 'https://')):
+            raise ValueError(f"Invalid model '{spec}', expected 'local', 'modal' or an URL")
+        return PlaceholderModel(spec.partition('#')[2] or endpoint_model)
+
+    @staticmethod
+    def create_all(specs: list[str], **kwargs) -> dict[str, IModel]:
+        """Create each distinct model of 'specs' once, so stages sharing a model share its instance."""
+        return {spec: ModelFactory.create_from_spec(spec, **kwargs) for spec in dict.fromkeys(specs)}
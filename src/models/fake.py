@@ -0,0 +1,117 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from . import IModel, GenerationConfig, Completion
+
+MODEL_NAME = "fake"
+
+
+class FakeModel(IModel):
+    """Local deterministic model returning schema-valid topics, questions and
+    validations, with configurable latency and failure rate."""
+
+    def __init__(self, latency_mean: float = 0.5, latency_std: float = 0.1, failure_rate: float = 0.05,
+                 seed: int = 0, max_in_flight: int = 4) -> None:
+        super().__init__(MODEL_NAME, max_in_flight)
+        self._latency_mean = latency_mean
+        self._latency_std = latency_std
+        self._failure_rate = failure_rate
+        self._seed = seed
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompts = 0
+        self.intervals = []
+
+    def generate(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> list[str]:
+        config = config or GenerationConfig()
+        rngs = [self.__get_random(system_prompt, user_prompt)
+                for user_prompt in user_prompts]
+
+        start = time.monotonic()
+        latency = max(rngs[0].gauss(self._latency_mean, self._latency_std), 0) \
+            if len(rngs) > 0 else 0
+        time.sleep(latency)
+
+        with self._lock:
+            self.calls += 1
+            self.prompts += len(user_prompts)
+            self.intervals.append((start, time.monotonic()))
+
+        # Responses longer than the token budget are truncated, as the real model would do
+        max_length = config.max_tokens * 3
+        responses = [self.__respond(system_prompt, user_prompt, rng, config)[:max_length]
+                     for user_prompt, rng in zip(user_prompts, rngs)]
+        return [Completion(response,
+                           prompt_tokens=self.count_tokens(system_prompt + user_prompt),
+                           completion_tokens=self.count_tokens(response))
+                for response, user_prompt in zip(responses, user_prompts)]
+
+    def get_generation_time(self) -> float:
+        """Wall-clock time during which at least one call was being generated."""
+        total, end = 0.0, None
+        for interval_start, interval_end in sorted(self.intervals):
+            if end is None or interval_start > end:
+                total += interval_end - interval_start
+                end = interval_end
+            elif interval_end > end:
+                total += interval_end - end
+                end = interval_end
+        return total
+
+    def __get_random(self, system_prompt: str, user_prompt: str) -> random.Random:
+        key = hashlib.sha256(
+            f'{system_prompt}{user_prompt}'.encode('utf-8')).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        return random.Random(f'{self._seed}:{key}:{attempt}')
+
+    def __respond(self, system_prompt: str, user_prompt: str, rng: random.Random, config: GenerationConfig) -> str:
+        fields = dict(re.findall(r'^\s*(\w+): (.*)$', user_prompt, re.MULTILINE))
+        words = re.findall(r'\w{4,}', fields.get('Document', ''))
+        number_of_items = int(next(iter(re.findall(
+            r'(?:extract|create) (\d+)', system_prompt)), 5))
+
+        number_of_scored_items = len(re.findall(r'^\s*\d+\. ', user_prompt, re.MULTILINE))
+
+        if '"score"' in system_prompt and number_of_scored_items > 0:
+            response = [self.__score(words, rng)
+                        for _ in range(number_of_scored_items)]
+        elif '"score"' in system_prompt:
+            response = self.__score(words, rng)
+        elif 'questions and answers' in system_prompt:
+            response = [dict(question=f"O que é {self.__sample(words, rng)} ?",
+                             answer=f"{self.__sample(words, rng, 12)}.")
+                        for _ in range(number_of_items)]
+        else:
+            response = [self.__sample(words, rng, 4).capitalize()
+                        for _ in range(number_of_items)]
+
+        output = json.dumps(response, ensure_ascii=False)
+        # Guided decoding makes the output valid by construction
+        if config.json_schema is None and rng.random() < self._failure_rate:
+            return self.__corrupt(output, rng)
+        return output
+
+    def __score(self, words: list[str], rng: random.Random) -> dict:
+        return dict(score=round(rng.random(), 1),
+                    reason=f"Documento relacionado a {self.__sample(words, rng)}.")
+
+    def __sample(self, words: list[str], rng: random.Random, count: int = 2) -> str:
+        if len(words) == 0:
+            return "manutenção veicular"
+        return " ".join(rng.choice(words) for _ in range(count))
+
+    def __corrupt(self, output: str, rng: random.Random) -> str:
+        defect = rng.choice(['truncated', 'prose', 'fence', 'malformed'])
+        if defect == 'truncated':
+            return output[:rng.randint(1, max(len(output) - 1, 1))]
+        if defect == 'prose':
+            return f"{output}\nEspero que isso ajude!"
+        if defect == 'fence':
+            return f"```json\n{output}\n```"
+        return output.replace('"', "'", 1)
@@ -1,13 +1,21 @@
 import os
+import modal
 from modal import Image, Secret, Stub, enter, gpu, method, Function, Retries
 from modal.cli.run import deploy_app
-from models import IModel
+from models import IModel, GenerationConfig, Completion
+from models import tokenizer
+from models.tokenizer import BASE_MODEL, MODEL_NAME, count_tokens
+from dataclasses import asdict
+from utils import save_json, read_json
+from utils.concurrency import AdaptiveLimiter
+from utils.constants import CACHE_DIR
+from pathlib import Path
+import hashlib
 import logging
-import time
+import threading
 
 MODEL_DIR = "/model"
-BASE_MODEL = "internlm/internlm2-chat-7b"
-MODEL_NAME = "internlm"
+DEPLOYMENT_FILE = f'{CACHE_DIR}/modal_deployment.json'
 
 
 def download_model_to_folder():
@@ -30,10 +38,10 @@ image = (
         "nvidia/cuda:12.1.1-devel-ubuntu22.04", add_python="3.10"
     )
     .pip_install(
-        "vllm==0.3.2",
-        "huggingface_hub==0.19.4",
-        "hf-transfer==0.1.4",
-        "torch==2.1.2",
+        "vllm==0.4.2",
+        "huggingface_hub==0.22.2",
+        "hf-transfer==0.1.6",
+        "torch==2.3.0",
         "accelerate",
         "einops"
     )
@@ -47,6 +55,8 @@ image = (
 
 stub = Stub(MODEL_NAME, image=image)
 GPU_CONFIG = gpu.A100(count=1)
+# Reuse the KV cache of the system prompt and documents shared between prompts
+ENABLE_PREFIX_CACHING = True
 
 
 @stub.cls(gpu=GPU_CONFIG, secrets=[Secret.from_name("huggingface-secret")], timeout=600)
@@ -59,28 +69,46 @@ class ModalModel:
             MODEL_DIR,
             enforce_eager=True,  # skip graph capturing for faster cold starts
             tensor_parallel_size=GPU_CONFIG.count,
-            trust_remote_code=True
+            trust_remote_code=True,
+            enable_prefix_caching=ENABLE_PREFIX_CACHING
         )
         self.template = """<s><|im_start|>system\n{system_prompt}<|im_end|>\n"""
         self.template += """<|im_start|>user\n{query}<|im_end|>\n<|im_start|>assistant\n"""
 
     @method()
-    def generate(self, system_prompt: str, user_prompts: list[str]) -> list[str]:
-        import time
+    def ping(self) -> bool:
+        """No-op called to start a container, loading the model, ahead of the first batch."""
+        return True
+
+    @method()
+    def generate(self, system_prompt: str, user_prompts: list[str], config: dict = None) -> list[dict]:
         import vllm
 
+        from vllm.model_executor.guided_decoding.outlines_logits_processors import JSONLogitsProcessor
+
+        config = config or {}
         end_token = '<|im_end|>'
         tokenizer = self.llm.llm_engine.tokenizer.tokenizer
-        sampling_params = vllm.SamplingParams(
-            temperature=0.7,
-            top_p=0.9,
-            max_tokens=2048,
-            skip_special_tokens=False,
-            stop_token_ids=[tokenizer.eos_token_id,
-                            tokenizer.convert_tokens_to_ids([end_token])[0]]
-        )
-
-        start = time.monotonic_ns()
+        json_schema = config.get('json_schema')
+
+        def create_sampling_params():
+            # The JSON logits processor keeps the state of a single sequence
+            logits_processors = [JSONLogitsProcessor(json_schema, tokenizer)] \
+                if json_schema else None
+            return vllm.SamplingParams(
+                temperature=config.get('temperature', 0.7),
+                top_p=config.get('top_p', 0.9),
+                max_tokens=config.get('max_tokens', 2048),
+                stop=config.get('stop') or None,
+                include_stop_str_in_output=True,
+                skip_special_tokens=False,
+                logits_processors=logits_processors,
+                stop_token_ids=[tokenizer.eos_token_id,
+                                tokenizer.convert_tokens_to_ids([end_token])[0]]
+            )
+
+        sampling_params = [create_sampling_params() for _ in user_prompts] \
+            if json_schema else create_sampling_params()
 
         tokezined_prompts = []
         for prompt in user_prompts:
@@ -94,35 +122,88 @@ class ModalModel:
             decoded_output = tokenizer.decode(
                 output.outputs[0].token_ids, skip_special_tokens=True)
             decoded_output = decoded_output.split("<|im_end|>")[0]
-            response.append(decoded_output)
-
-        duration_s = (time.monotonic_ns() - start) / 1e9
-
-        print(f"Duration: {duration_s}")
+            response.append(dict(text=decoded_output,
+                                 prompt_tokens=len(output.prompt_token_ids),
+                                 completion_tokens=len(output.outputs[0].token_ids)))
 
         return response
 
 
 class InternLM(IModel):
-    def __init__(self, max_retries=5) -> None:
-        super().__init__(MODEL_NAME)
+    """Client of the model deployed on Modal. The app is only deployed again
+    when this module or the Modal version changed since the last deployment,
+    or when 'redeploy' is set."""
+
+    def __init__(self, max_retries=5, max_in_flight=4, redeploy=False) -> None:
         self._max_retries = max_retries
+        self._redeploy = redeploy
+        self._limiter = AdaptiveLimiter(max_in_flight)
+        self._generate_function = None
+        self._lock = threading.Lock()
         self._logger = logging.getLogger(__name__)
+        super().__init__(MODEL_NAME, max_in_flight)
 
     def lodal_model(self):
+        deployment_hash = self.__get_deployment_hash()
+        if not self._redeploy and self.__get_deployed_hash() == deployment_hash:
+            try:
+                self.__get_generate_function()
+                self._logger.info("Reusing the deployed Modal app")
+                return
+            except Exception as exception:
+                self._logger.warning(
+                    f"Deployed Modal app not found, deploying it again: {exception}")
+
+        self._generate_function = None
         deploy_app(stub)
-        pass
-
-    def generate(self, system_prompt: str, user_prompts: list[str]) -> list[str]:
-        generate_function = Function.lookup(MODEL_NAME, 'ModalModel.generate')
+        Path(DEPLOYMENT_FILE).parent.mkdir(parents=True, exist_ok=True)
+        save_json(DEPLOYMENT_FILE, dict(app=MODEL_NAME, hash=deployment_hash))
+
+    def prewarm(self, containers: int = 1) -> None:
+        try:
+            ping_function = Function.lookup(MODEL_NAME, 'ModalModel.ping')
+            for _ in range(containers):
+                ping_function.spawn()
+        except Exception as exception:
+            self._logger.warning(f"Could not prewarm the model: {exception}")
+
+    def generate(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> list[str]:
+        config = config or GenerationConfig()
         last_exception = None
         for i in range(self._max_retries):
             try:
-                time.sleep(0.3)
-                return generate_function.remote(system_prompt, user_prompts)
-            except AttributeError as exception:
+                with self._limiter:
+                    function_call = self.__get_generate_function().spawn(
+                        system_prompt, user_prompts, asdict(config))
+                    return [Completion(**output) for output in function_call.get()]
+            except Exception as exception:
                 self._logger.error(exception)
                 last_exception = exception
                 continue
 
         raise last_exception
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text)
+
+    def __get_deployment_hash(self) -> str:
+        # the tokenizer module holds the model deployed by this one
+        digest = hashlib.sha256()
+        for file in (__file__, tokenizer.__file__):
+            with open(file, 'rb') as fp:
+                digest.update(fp.read())
+        digest.update(modal.__version__.encode('utf-8'))
+        return digest.hexdigest()
+
+    def __get_deployed_hash(self) -> str:
+        if not os.path.isfile(DEPLOYMENT_FILE):
+            return None
+        deployment = read_json(DEPLOYMENT_FILE)
+        return deployment.get('hash') if deployment.get('app') == MODEL_NAME else None
+
+    def __get_generate_function(self) -> Function:
+        with self._lock:
+            if self._generate_function is None:
+                self._generate_function = Function.lookup(
+                    MODEL_NAME, 'ModalModel.generate')
+            return self._generate_function
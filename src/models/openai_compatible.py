@@ -0,0 +1,117 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import IModel, GenerationConfig, Completion
+
+RETRY_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    def __init__(self, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OpenAICompatibleModel(IModel):
+    """Model served by an OpenAI-compatible chat completions endpoint, such as
+    vLLM, TGI or llama.cpp. Each prompt is sent as its own request over a pool of
+    keep-alive connections, at most 'max_concurrent_requests' at a time across
+    all the batches, and transient errors are retried with jittered exponential
+    back-off. The JSON schema is sent as vLLM's 'guided_json' when 'guided_json'
+    is set."""
+
+    def __init__(self, base_url: str, model_name: str, api_key: str = None, max_in_flight: int = 4,
+                 max_concurrent_requests: int = 32, max_retries: int = 5, timeout: float = 300.0,
+                 initial_delay: float = 0.5, max_delay: float = 30.0, guided_json: bool = True) -> None:
+        self._url = f"{base_url.rstrip('/')}/chat/completions"
+        self._api_key = api_key
+        self._max_retries = max_retries
+        self._timeout = timeout
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._guided_json = guided_json
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        # more workers than connections, so prompts waiting to be retried do not hold a request slot
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_requests * 2)
+        self._session = self.__create_session(max_concurrent_requests)
+        self._logger = logging.getLogger(__name__)
+        super().__init__(model_name, max_in_flight)
+
+    def generate(self, system_prompt: str, user_prompts: list[str], config: GenerationConfig = None) -> list[str]:
+        config = config or GenerationConfig()
+        futures = [self._executor.submit(self.__complete, system_prompt, user_prompt, config)
+                   for user_prompt in user_prompts]
+        return [future.result() for future in futures]
+
+    def __complete(self, system_prompt: str, user_prompt: str, config: GenerationConfig) -> Completion:
+        payload = dict(
+            model=self.model_name,
+            messages=[dict(role='system', content=system_prompt),
+                      dict(role='user', content=user_prompt)],
+            max_tokens=config.max_tokens,
+            temperature=config.temperature,
+            top_p=config.top_p,
+            # vLLM extension, other servers ignore it and the stop string is restored below
+            include_stop_str_in_output=True)
+        if config.stop:
+            payload['stop'] = config.stop
+        if config.json_schema and self._guided_json:
+            payload['guided_json'] = config.json_schema
+
+        for attempt in range(self._max_retries):
+            try:
+                with self._semaphore:
+                    data = self.__post(payload)
+                return self.__to_completion(data, config)
+            except TransientError as error:
+                if attempt == self._max_retries - 1:
+                    raise
+                # full jitter keeps the retries of concurrent requests apart
+                delay = random.uniform(0, min(self._initial_delay * 2 ** attempt, self._max_delay))
+                delay = max(delay, error.retry_after or 0)
+                self._logger.warning(f"{error}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def __post(self, payload: dict) -> dict:
+        import requests
+
+        try:
+            response = self._session.post(self._url, json=payload, timeout=self._timeout)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            raise TransientError(f"Request to {self._url} failed: {error}") from error
+
+        if response.status_code in RETRY_STATUS_CODES:
+            retry_after = response.headers.get('Retry-After')
+            raise TransientError(f"Request to {self._url} failed with status {response.status_code}",
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+        response.raise_for_status()
+        return response.json()
+
+    def __to_completion(self, data: dict, config: GenerationConfig) -> Completion:
+        choice = data['choices'][0]
+        text = choice['message'].get('content') or ''
+        if choice.get('finish_reason') == 'stop':
+            stop_reason = choice.get('stop_reason')
+            if not isinstance(stop_reason, str) and len(config.stop) == 1:
+                stop_reason = config.stop[0]
+            if isinstance(stop_reason, str) and stop_reason in config.stop and not text.endswith(stop_reason):
+                text += stop_reason
+
+        usage = data.get('usage') or {}
+        return Completion(text,
+                          prompt_tokens=usage.get('prompt_tokens', 0),
+                          completion_tokens=usage.get('completion_tokens', 0))
+
+    def __create_session(self, pool_size: int):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if self._api_key:
+            session.headers['Authorization'] = f'Bearer {self._api_key}'
+        return session
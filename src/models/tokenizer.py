@@ -0,0 +1,25 @@
+import functools
+import logging
+from utils import estimate_tokens
+
+BASE_MODEL = "internlm/internlm2-chat-7b"
+MODEL_NAME = "internlm"
+
+
+@functools.cache
+def load_tokenizer(model_name: str = BASE_MODEL):
+    """Hugging Face tokenizer of the model, None when transformers or the model files are not available."""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    except Exception as exception:
+        logging.getLogger(__name__).warning(
+            f"Using estimated token counts, tokenizer not available: {exception}")
+        return None
+
+
+def count_tokens(text: str, model_name: str = BASE_MODEL) -> int:
+    tokenizer = load_tokenizer(model_name)
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False))
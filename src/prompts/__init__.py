@@ -1,17 +1,34 @@
 from abc import ABC, abstractmethod
-from models import IModel
-from dataclasses import dataclass, replace
-from utils import load_json, save_json, chunker
-from typing import Self
+from models import IModel, GenerationConfig
+from dataclasses import dataclass, replace, asdict
+from utils import load_json, chunker, prefetch, estimate_tokens, JsonlWriter
+from utils.checkpoints import CheckpointStore
+from utils.metrics import MetricsRecorder
+from .scheduler import RequestScheduler
+from .prefilter import LexicalPrefilter
+from typing import ClassVar, Iterable, Iterator, Self
 import logging
 from pathlib import Path
 import time
 import re
+import json
+import hashlib
+import threading
+from collections import Counter
 
 from utils.constants import OUTPUT_DIR
 
 CHECKPOINTS_DIR = f'{OUTPUT_DIR}/checkpoints'
 
+VALIDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number"},
+        "reason": {"type": "string"}
+    },
+    "required": ["score", "reason"]
+}
+
 
 @dataclass
 class PromptTemplate:
@@ -24,25 +41,65 @@ class PromptTemplate:
         return self.user_prompt.format(**{var: args[var] for var in self.variables})
 
 
-@dataclass
+class SectionStore:
+    """Texts of the sections referenced by the requests, keyed by their content hash,
+    so requests and checkpoints carry the key instead of a copy of the text."""
+
+    def __init__(self) -> None:
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def add(self, text: str) -> str:
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self._texts.setdefault(key, text)
+        return key
+
+    def get(self, key: str) -> str:
+        return self._texts[key]
+
+
+@dataclass(slots=True)
 class PromptRequest:
     metadata: dict
     data: dict
+    # shared by all the requests, resolves the 'document_ref' of the data
+    sections: ClassVar[SectionStore] = SectionStore()
+
+    @classmethod
+    def from_document(cls, metadata: dict, document: str) -> 'PromptRequest':
+        return cls(metadata=metadata, data=dict(document_ref=cls.sections.add(document)))
 
     def update(self, data: dict, metadata: dict):
         return PromptRequest(
             metadata={**self.metadata, **metadata},
             data={**self.data, **data})
 
+    def resolve(self) -> dict:
+        """Data with the text of the referenced document, used to format the prompts."""
+        if 'document_ref' not in self.data:
+            return self.data
+        return {'document' if key == 'document_ref' else key:
+                self.sections.get(value) if key == 'document_ref' else value
+                for key, value in self.data.items()}
 
-@dataclass
+    def resolved(self) -> 'PromptRequest':
+        return PromptRequest(metadata=self.metadata, data=self.resolve())
+
+    def key(self) -> str:
+        content = json.dumps(dict(metadata=self.metadata, data=self.data),
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+@dataclass(slots=True)
 class PromptValidationRequest:
     request: PromptRequest
     score: float
     reason: str
 
 
-@dataclass
+@dataclass(slots=True)
 class FailedPromptRequest:
     request: PromptRequest
     response_data: str
@@ -52,126 +109,489 @@ class FailedPromptRequest:
 class PromptHandler(ABC):
     _next_handler: Self = None
     _model: IModel = None
+    _checkpoint_store: CheckpointStore = None
+    # shared by all the handlers, replace it to write the metrics to a file
+    metrics: MetricsRecorder = MetricsRecorder()
     _logger = logging.getLogger(__name__)
 
     def __init__(self, model: IModel) -> None:
         self._model = model
         self.max_retries = 10
+        self.retry_budget = None
+        self.max_batch_tokens = None
+        self.group_by_document = True
+        self.guided_decoding = True
+        self.use_cache = True
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
 
     def set_next(self, handler: Self) -> Self:
         self._next_handler = handler
         return handler
 
-    def handle(self, requests: list[PromptRequest], batch_size: int = 100) -> list[PromptRequest]:
+    def handle(self, requests: list[PromptRequest], batch_size: int = 100, streaming: bool = False,
+               resume: bool = False) -> list[PromptRequest]:
+        if streaming:
+            return list(self.stream(requests, batch_size, resume))
+
         self._logger.info(f"Starting '{self.__get_name()}' prompt template")
         successful_requests = []
         requests_count = len(requests)
         processed_count = 0
-        for batch_requests in chunker(requests, batch_size):
-            processed_count += len(batch_requests)
-            self._logger.info(
-                f"Processing {processed_count} / {requests_count}")
-
-            for i in range(1, self.max_retries + 1):
-                batch_successful_requests, batch_error_requests = self.generate(
-                    requests=batch_requests
-                )
-
+        with self.open_checkpoint() as checkpoint:
+            for batch_processed_count, batch_successful_requests in self.__run_stage(requests, batch_size, resume):
+                processed_count += batch_processed_count
+                self._logger.info(
+                    f"Processing {processed_count} / {requests_count}")
                 successful_requests.extend(batch_successful_requests)
-
-                if len(batch_error_requests) == 0:
-                    break
-
-                if (i < self.max_retries):
-                    batch_requests = [error_request.request
-                                      for error_request in batch_error_requests]
-                    self._logger.info(
-                        f"Retrying ({i}/{self.max_retries}) {len(batch_requests)} request(s)")
-                else:
-                    self._logger.info(
-                        f"Found {len(batch_error_requests)} error(s)")
-                    self.save_checkpoint(
-                        batch_error_requests, suffix='__error')
-
-        self.save_checkpoint(successful_requests)
+                checkpoint.write(batch_successful_requests)
 
         self._logger.info(f"Finished '{self.__get_name()}' prompt template")
 
         if self._next_handler and len(successful_requests) > 0:
             self._logger.info("Calling next handler")
-            return self._next_handler.handle(successful_requests)
+            return self._next_handler.handle(successful_requests, batch_size, resume=resume)
 
         return successful_requests
 
-    def generate(self, requests: list[PromptRequest]) -> tuple[list[PromptRequest], list[FailedPromptRequest]]:
+    def stream(self, requests: Iterable[PromptRequest], batch_size: int = 100,
+               resume: bool = False) -> Iterator[PromptRequest]:
+        """Chain the handlers as generators, each one running in its own thread,
+        so batches flow to the next stage as soon as they are ready."""
+        stage_requests = self._stream_stage(requests, batch_size, resume)
+        if self._next_handler:
+            return self._next_handler.stream(prefetch(stage_requests), batch_size, resume)
+        return stage_requests
+
+    def _stream_stage(self, requests: Iterable[PromptRequest], batch_size: int,
+                      resume: bool) -> Iterator[PromptRequest]:
+        self._logger.info(
+            f"Starting '{self.__get_name()}' prompt template (streaming)")
+        processed_count = 0
+        with self.open_checkpoint() as checkpoint:
+            for batch_processed_count, batch_successful_requests in self.__run_stage(requests, batch_size, resume):
+                processed_count += batch_processed_count
+                self._logger.info(
+                    f"Processing {processed_count} request(s) of '{self.__get_name()}'")
+                checkpoint.write(batch_successful_requests)
+                yield from batch_successful_requests
+
+        self._logger.info(f"Finished '{self.__get_name()}' prompt template")
+
+    def __run_stage(self, requests: Iterable[PromptRequest], batch_size: int,
+                    resume: bool) -> Iterator[tuple[int, list]]:
+        scheduler = RequestScheduler(
+            self._generate_batch, batch_size,
+            max_in_flight=self._model.max_in_flight,
+            max_retries=self.max_retries,
+            retry_budget=self.retry_budget,
+            resume=self.__resume if resume else None,
+            count_tokens=self.__count_tokens,
+            max_batch_tokens=self.max_batch_tokens,
+            group_key=self.__get_document_key if self.group_by_document else None,
+            on_batch=self._record_batch)
+
+        yield from scheduler.run(requests)
+
+        self._count(requests=scheduler.requests_count,
+                     retries=scheduler.retries_count,
+                     errors=len(scheduler.failed_requests))
+        self._logger.info(
+            f"Retried {scheduler.retries_count} request(s)")
+        if len(scheduler.failed_requests) > 0:
+            self._logger.info(
+                f"Found {len(scheduler.failed_requests)} error(s)")
+            self.save_checkpoint(
+                scheduler.failed_requests, suffix='__error')
+
+        self.on_stage_finished()
+
+    def _record_batch(self, metrics: Counter, results: list):
+        self.metrics.record(self.__get_name(), model=self._model.model_name, **metrics)
+
+    def __get_document_key(self, request: PromptRequest) -> tuple:
+        return (request.metadata.get('document_id'), request.metadata.get('section'))
+
+    def __count_tokens(self, request: PromptRequest) -> int:
+        prompt = self.get_prompt_template().format(request.resolve())
+        # exact counts only matter under a token budget, estimates are enough to sort by length
+        tokens = self._model.count_tokens(prompt) if self.max_batch_tokens else estimate_tokens(prompt)
+        return tokens + self.get_generation_config().max_tokens
+
+    def _count(self, **counts: int):
+        with self._stats_lock:
+            self.stats.update(counts)
+
+    def generate(self, requests: list[PromptRequest],
+                 metrics: Counter = None) -> tuple[list[PromptRequest], list[FailedPromptRequest]]:
+        metrics = Counter() if metrics is None else metrics
         prompt_template = self.get_prompt_template()
-        user_prompts = [prompt_template.format(request.data)
+        user_prompts = [prompt_template.format(request.resolve())
                         for request in requests]
-        response = self._model.generate(
-            prompt_template.system_prompt, user_prompts)
+        config = self.__get_guided_generation_config()
+        model = self._get_model()
+        response = self._generate_responses(
+            model, prompt_template.system_prompt, user_prompts, config, metrics)
         error_requests = []
         successful_requests = []
-        for response_data, request in zip(response, requests):
+        error_prompts = []
+        results = {}
+        for response_data, request, user_prompt in zip(response, requests, user_prompts):
             try:
-                obj = self.to_object(load_json(response_data), request)
+                obj = self.__parse(response_data, request)
+                results[request.key()] = [asdict(item) for item in obj]
                 if len(obj) > 0:
                     successful_requests.extend(obj)
             except Exception as error:
                 error_requests.append(FailedPromptRequest(
                     request, response_data, error))
+                error_prompts.append(user_prompt)
+        if len(error_prompts) > 0:
+            metrics.update(parse_failures=len(error_prompts))
+            model.discard(prompt_template.system_prompt, error_prompts, config)
+        self._save_results(results)
         return successful_requests, error_requests
 
+    def _generate_responses(self, model: IModel, system_prompt: str, user_prompts: list[str],
+                            config: GenerationConfig, metrics: Counter) -> list[str]:
+        """Call the model, adding the token usage and cache hits of the responses to 'metrics'."""
+        response = model.generate(system_prompt, user_prompts, config)
+        metrics.update(prompts=len(user_prompts),
+                       prompt_tokens=sum(getattr(data, 'prompt_tokens', 0) for data in response),
+                       completion_tokens=sum(getattr(data, 'completion_tokens', 0) for data in response),
+                       cache_hits=sum(getattr(data, 'cached', False) for data in response))
+        return response
+
+    def _generate_batch(self, requests: list[PromptRequest],
+                        metrics: Counter) -> tuple[list, list[FailedPromptRequest]]:
+        """Process a batch of the stage, by default with a single 'generate' call."""
+        return self.generate(requests, metrics)
+
+    def get_planned_prompts(self, requests: list[PromptRequest]) -> list[tuple[str, str, GenerationConfig]]:
+        """System prompt, user prompt and generation settings of each prompt the stage
+        would send for the requests, used to plan runs without calling the model."""
+        prompt_template = self.get_prompt_template()
+        config = self.__get_guided_generation_config()
+        return [(prompt_template.system_prompt, prompt_template.format(request.resolve()), config)
+                for request in requests]
+
+    def _get_model(self) -> IModel:
+        return self._model if self.use_cache else self._model.without_cache()
+
+    def _save_results(self, results: dict[str, list[dict]]):
+        self.__get_checkpoint_store().save(self.__get_name(), results)
+
+    def __parse(self, response_data: str, request: PromptRequest) -> list:
+        repairs = Counter()
+        json = load_json(response_data, repairs)
+        try:
+            obj = self.to_object(json, request)
+        except Exception:
+            if not isinstance(json, list):
+                raise
+            obj = self.__salvage_elements(json, request, repairs)
+        self._count(**{f'repair_{name}': count for name, count in repairs.items()})
+        return obj
+
+    def __salvage_elements(self, json: list, request: PromptRequest, repairs: Counter) -> list:
+        obj = []
+        last_error = None
+        for element in json:
+            try:
+                obj.extend(self.to_object([element], request))
+            except Exception as error:
+                repairs.update(['invalid_element'])
+                last_error = error
+        if len(obj) == 0:
+            raise last_error
+        return obj
+
+    def __resume(self, requests: list[PromptRequest]) -> tuple[list[PromptRequest], list]:
+        successful_requests = []
+        stored_results = self.__get_checkpoint_store().load(
+            self.__get_name(), [request.key() for request in requests])
+        pending_requests = []
+        for request in requests:
+            results = stored_results.get(request.key())
+            if results is None:
+                pending_requests.append(request)
+            else:
+                successful_requests.extend(
+                    self.load_result(result) for result in results)
+
+        resumed_count = len(requests) - len(pending_requests)
+        if resumed_count > 0:
+            self._logger.info(
+                f"Resumed {resumed_count} request(s) from checkpoint store")
+        return pending_requests, successful_requests
+
+    def __get_checkpoint_store(self) -> CheckpointStore:
+        if PromptHandler._checkpoint_store is None:
+            PromptHandler._checkpoint_store = CheckpointStore(
+                f'{CHECKPOINTS_DIR}/checkpoints.db')
+        return PromptHandler._checkpoint_store
+
+    def load_result(self, data: dict) -> PromptRequest:
+        return PromptRequest(**data)
+
     def __get_name(self) -> str:
         return self.get_prompt_template().name
 
-    def save_checkpoint(self, data: list[object], suffix=''):
+    def open_checkpoint(self, suffix='') -> JsonlWriter:
+        """Open a JSON Lines checkpoint, the records are appended as they are written."""
         Path(CHECKPOINTS_DIR).mkdir(parents=True, exist_ok=True)
         ts = time.strftime("%Y%m%d-%H%M%S")
         filename = re.sub(r'(?<!^)(?=[A-Z])', '_', self.__get_name()).lower()
-        checkpoint_file = f'{CHECKPOINTS_DIR}/{filename}{suffix}_{ts}.json'
-        save_json(checkpoint_file, data)
+        checkpoint_file = f'{CHECKPOINTS_DIR}/{filename}{suffix}_{ts}.jsonl'
+        return JsonlWriter(checkpoint_file, append=False)
+
+    def save_checkpoint(self, data: list[object], suffix=''):
+        with self.open_checkpoint(suffix) as checkpoint:
+            checkpoint.write(data)
 
     @abstractmethod
     def get_prompt_template() -> PromptTemplate:
         pass
 
+    def get_generation_config(self) -> GenerationConfig:
+        return GenerationConfig()
+
+    def on_stage_finished(self):
+        """Called once all the requests of the stage were processed."""
+        pass
+
+    def get_json_schema(self) -> dict:
+        """JSON schema of the expected response, used for guided decoding."""
+        return None
+
+    def __get_guided_generation_config(self) -> GenerationConfig:
+        config = self.get_generation_config()
+        if self.guided_decoding:
+            config = replace(config, json_schema=self.get_json_schema())
+        return config
+
     @abstractmethod
     def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
         pass
 
 
 class PromptValidationHandler(PromptHandler):
+    """When a 'prefilter' is set, the requests it is confident about are validated
+    by their lexical score against the document instead of by the model."""
+
     def __init__(self, model: IModel, score_threshold: float = 0.1) -> None:
         super().__init__(model)
         self._score_threshold = score_threshold
+        self.prefilter: LexicalPrefilter = None
+
+    def handle(self, requests: list[PromptRequest], batch_size: int = 100, streaming: bool = False,
+               resume: bool = False) -> list[PromptRequest]:
+        if streaming:
+            return list(self.stream(requests, batch_size, resume))
 
-    def handle(self, requests: list[PromptRequest], batch_size: int = 100) -> list[PromptRequest]:
         next_handler = self._next_handler
         self._next_handler = None
 
-        validation_requests = super().handle(requests, batch_size)
+        validation_requests = super().handle(
+            requests, batch_size, resume=resume)
 
         successful_requests = []
+        passed_validations = []
         failed_validations = []
         for validation in validation_requests:
             if validation.score >= self._score_threshold:
                 successful_requests.append(validation.request)
+                passed_validations.append(validation)
             else:
                 failed_validations.append(validation)
 
-        self.save_checkpoint(successful_requests, suffix='__passed')
-
-        if (len(failed_validations) > 0):
-            self.save_checkpoint(failed_validations, suffix='__failed')
+        self.save_checkpoint(passed_validations, suffix='__passed')
+        self.save_checkpoint(failed_validations, suffix='__failed')
 
         if next_handler and len(successful_requests) > 0:
             self._logger.info("Calling next handler")
-            return next_handler.handle(successful_requests)
+            return next_handler.handle(successful_requests, batch_size, resume=resume)
 
         return successful_requests
 
+    def _stream_stage(self, requests: Iterable[PromptRequest], batch_size: int,
+                      resume: bool) -> Iterator[PromptRequest]:
+        with self.open_checkpoint(suffix='__passed') as passed_checkpoint, \
+                self.open_checkpoint(suffix='__failed') as failed_checkpoint:
+            for validation in super()._stream_stage(requests, batch_size, resume):
+                if validation.score >= self._score_threshold:
+                    passed_checkpoint.write([validation])
+                    yield validation.request
+                else:
+                    failed_checkpoint.write([validation])
+
+    def _generate_batch(self, requests: list[PromptRequest],
+                        metrics: Counter) -> tuple[list[PromptValidationRequest], list[FailedPromptRequest]]:
+        if self.prefilter is None:
+            return super()._generate_batch(requests, metrics)
+
+        validations = []
+        pending_requests = []
+        for request in requests:
+            text = self.get_prefilter_text(request)
+            # requests without a text to score, or with a malformed one, are left to the model
+            accepted, score = self.prefilter.decide(text, request.resolve()['document']) \
+                if isinstance(text, str) else (None, 0.0)
+            if accepted is None:
+                pending_requests.append(request)
+            else:
+                validations.append(PromptValidationRequest(
+                    request=request,
+                    score=1.0 if accepted else 0.0,
+                    reason=f"Lexical pre-filter score {score:.2f}"))
+        accepted_count = sum(validation.score > 0 for validation in validations)
+        metrics.update(prefilter_accepted=accepted_count,
+                       prefilter_rejected=len(validations) - accepted_count)
+
+        if len(pending_requests) == 0:
+            return validations, []
+        successful_requests, error_requests = super()._generate_batch(
+            pending_requests, metrics)
+        return validations + successful_requests, error_requests
+
+    def get_prefilter_text(self, request: PromptRequest) -> str:
+        """Text of the request scored by the pre-filter against the document, None
+        when the stage does not support the pre-filter."""
+        return None
+
+    def _record_batch(self, metrics: Counter, results: list[PromptValidationRequest]):
+        passed_count = sum(validation.score >= self._score_threshold
+                           for validation in results)
+        metrics.update(passed=passed_count, rejected=len(results) - passed_count)
+        super()._record_batch(metrics, results)
+
+    def get_generation_config(self) -> GenerationConfig:
+        return GenerationConfig(max_tokens=256, temperature=0.2, stop=['}'])
+
+    def get_json_schema(self) -> dict:
+        return VALIDATION_SCHEMA
+
     def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
+        score = json.get('score', 0.0)
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            raise ValueError(f"Expected a numeric score, got: {json}")
         return [PromptValidationRequest(
             request=request,
-            score=json.get('score', 0.0),
+            score=score,
             reason=json.get('reason', None))]
+
+    def load_result(self, data: dict) -> PromptValidationRequest:
+        return PromptValidationRequest(
+            request=PromptRequest(**data['request']),
+            score=data['score'],
+            reason=data['reason'])
+
+
+class PromptBatchValidationHandler(PromptValidationHandler):
+    """Validates up to 'max_items' requests of the same document in a single
+    prompt, falling back to one prompt per request when the response does not
+    have a score for each of them."""
+
+    def __init__(self, model: IModel, score_threshold: float = 0.1, max_items: int = 10) -> None:
+        super().__init__(model, score_threshold)
+        self._max_items = max_items
+
+    def generate(self, requests: list[PromptRequest],
+                 metrics: Counter = None) -> tuple[list[PromptValidationRequest], list[FailedPromptRequest]]:
+        metrics = Counter() if metrics is None else metrics
+        batch_groups, fallback_requests = self.__group(requests)
+
+        successful_requests = []
+        if len(batch_groups) > 0:
+            prompt_template = self.get_batch_prompt_template()
+            user_prompts = [prompt_template.format(self.__get_batch_data(group_requests))
+                            for group_requests in batch_groups]
+            config = self.get_batch_generation_config()
+            model = self._get_model()
+            response = self._generate_responses(
+                model, prompt_template.system_prompt, user_prompts, config, metrics)
+
+            results = {}
+            error_prompts = []
+            for response_data, group_requests, user_prompt in zip(response, batch_groups, user_prompts):
+                validations = self.__parse_batch(response_data, group_requests)
+                if validations is None:
+                    fallback_requests.extend(group_requests)
+                    error_prompts.append(user_prompt)
+                    continue
+                for request, validation in zip(group_requests, validations):
+                    results[request.key()] = [asdict(validation)]
+                successful_requests.extend(validations)
+
+            if len(error_prompts) > 0:
+                self._count(batch_validation_fallbacks=len(error_prompts))
+                metrics.update(batch_validation_fallbacks=len(error_prompts))
+                model.discard(prompt_template.system_prompt,
+                              error_prompts, config)
+            self._save_results(results)
+
+        if len(fallback_requests) == 0:
+            return successful_requests, []
+
+        fallback_successful_requests, error_requests = super().generate(
+            fallback_requests, metrics)
+        return successful_requests + fallback_successful_requests, error_requests
+
+    def get_planned_prompts(self, requests: list[PromptRequest]) -> list[tuple[str, str, GenerationConfig]]:
+        batch_groups, fallback_requests = self.__group(requests)
+        prompt_template = self.get_batch_prompt_template()
+        config = self.get_batch_generation_config()
+        return [(prompt_template.system_prompt, prompt_template.format(self.__get_batch_data(group_requests)), config)
+                for group_requests in batch_groups] + super().get_planned_prompts(fallback_requests)
+
+    def __group(self, requests: list[PromptRequest]) -> tuple[list[list[PromptRequest]], list[PromptRequest]]:
+        """Split the requests of each document in groups of up to 'max_items' validated
+        in a single prompt, and the requests left alone, validated one by one."""
+        groups = {}
+        for request in requests:
+            key = (request.metadata.get('document_id'),
+                   request.metadata.get('section'))
+            groups.setdefault(key, []).append(request)
+
+        batch_groups = []
+        fallback_requests = []
+        for group in groups.values():
+            for group_requests in chunker(group, self._max_items):
+                if len(group_requests) > 1:
+                    batch_groups.append(group_requests)
+                else:
+                    fallback_requests.extend(group_requests)
+        return batch_groups, fallback_requests
+
+    def get_batch_generation_config(self) -> GenerationConfig:
+        config = self.get_generation_config()
+        json_schema = dict(type="array", items=VALIDATION_SCHEMA,
+                           minItems=1, maxItems=self._max_items)
+        return GenerationConfig(max_tokens=config.max_tokens * self._max_items,
+                                temperature=config.temperature,
+                                top_p=config.top_p,
+                                stop=[']'],
+                                json_schema=json_schema if self.guided_decoding else None)
+
+    def __get_batch_data(self, requests: list[PromptRequest]) -> dict:
+        items = "\n".join(f"{i}. {self.format_item(request)}"
+                          for i, request in enumerate(requests, start=1))
+        return {**requests[0].resolve(), 'items': items}
+
+    def __parse_batch(self, response_data: str, requests: list[PromptRequest]) -> list[PromptValidationRequest]:
+        try:
+            json = load_json(response_data)
+            if not isinstance(json, list) or len(json) != len(requests):
+                return None
+            return [self.to_object(element, request)[0]
+                    for element, request in zip(json, requests)]
+        except Exception:
+            return None
+
+    @abstractmethod
+    def get_batch_prompt_template(self) -> PromptTemplate:
+        pass
+
+    @abstractmethod
+    def format_item(self, request: PromptRequest) -> str:
+        pass
@@ -0,0 +1,156 @@
+import random
+import re
+import threading
+import zlib
+from collections import Counter
+from dataclasses import dataclass, asdict
+from models import IModel, GenerationConfig
+from utils import normalize_text
+from . import PromptRequest, PromptTemplate, PromptHandler, FailedPromptRequest
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+@dataclass(slots=True)
+class DuplicatePromptRequest:
+    request: PromptRequest
+    duplicate_of: str
+    similarity: float
+
+
+class MinHashIndex:
+    """Locality-sensitive hashing index of character shingles, finding the texts
+    with an estimated Jaccard similarity above a threshold. Up to 'exact_limit'
+    texts are simply all compared, the MinHash signatures are only computed once
+    the index grows beyond it."""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 4, seed: int = 1,
+                 exact_limit: int = 100) -> None:
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                              for _ in range(num_perm)]
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._shingle_size = shingle_size
+        self._exact_limit = exact_limit
+        self._buckets = {}
+        self._items = []
+        self._hashed_count = 0
+
+    def query(self, text: str, threshold: float) -> tuple[str, float]:
+        """Return the most similar indexed text and its similarity, if above the threshold."""
+        shingles = self.__get_shingles(text)
+        if len(self._items) <= self._exact_limit:
+            candidates = range(len(self._items))
+        else:
+            self.__hash_items()
+            candidates = set()
+            for bucket in self.__get_buckets(shingles):
+                candidates.update(self._buckets.get(bucket, []))
+
+        best = (None, 0.0)
+        for candidate in candidates:
+            candidate_text, candidate_shingles = self._items[candidate]
+            similarity = len(shingles & candidate_shingles) / \
+                max(len(shingles | candidate_shingles), 1)
+            if similarity >= threshold and similarity > best[1]:
+                best = (candidate_text, similarity)
+        return best
+
+    def add(self, text: str) -> None:
+        self._items.append((text, self.__get_shingles(text)))
+
+    def __hash_items(self) -> None:
+        for i in range(self._hashed_count, len(self._items)):
+            for bucket in self.__get_buckets(self._items[i][1]):
+                self._buckets.setdefault(bucket, []).append(i)
+        self._hashed_count = len(self._items)
+
+    def __get_shingles(self, text: str) -> set[int]:
+        text = re.sub(r'[^\w]+', ' ', normalize_text(text)).strip()
+        if len(text) <= self._shingle_size:
+            return {zlib.crc32(text.encode('utf-8'))}
+        return {zlib.crc32(text[i:i + self._shingle_size].encode('utf-8'))
+                for i in range(len(text) - self._shingle_size + 1)}
+
+    def __get_buckets(self, shingles: set[int]) -> list[tuple]:
+        signature = [min((a * shingle + b) % MERSENNE_PRIME for shingle in shingles)
+                     for a, b in self._permutations]
+        return [(band, tuple(signature[band * self._rows:(band + 1) * self._rows]))
+                for band in range(self._bands)]
+
+
+class DeduplicationHandler(PromptHandler):
+    """Drops requests whose 'field' is a near-duplicate of one already seen in the
+    same section, or in the whole run when 'per_section' is False. No model call
+    is made, the dropped requests are saved in the '__dropped' checkpoint.
+    The decisions are stored like model results, so a resumed run replays them
+    instead of deciding again over requests arriving in another order."""
+
+    def __init__(self, model: IModel, field: str, threshold: float = 0.8, per_section: bool = True) -> None:
+        super().__init__(model)
+        self._field = field
+        self._threshold = threshold
+        self._per_section = per_section
+        self._indexes = {}
+        self._dropped_requests = []
+        self._lock = threading.Lock()
+
+    def get_prompt_template(self) -> PromptTemplate:
+        return PromptTemplate(
+            name=f"{self._field}s_deduplication",
+            system_prompt="",
+            user_prompt="",
+            variables=[]
+        )
+
+    def generate(self, requests: list[PromptRequest],
+                 metrics: Counter = None) -> tuple[list[PromptRequest], list[FailedPromptRequest]]:
+        successful_requests = []
+        results = {}
+        with self._lock:
+            for request in requests:
+                index = self.__get_index(request)
+                text = request.data[self._field]
+                duplicate_of, similarity = index.query(text, self._threshold)
+                if duplicate_of is None:
+                    index.add(text)
+                    successful_requests.append(request)
+                    results[request.key()] = [asdict(request)]
+                else:
+                    self._dropped_requests.append(
+                        DuplicatePromptRequest(request, duplicate_of, similarity))
+                    results[request.key()] = []
+        self._save_results(results)
+        if metrics is not None:
+            metrics.update(dropped=len(requests) - len(successful_requests))
+        return successful_requests, []
+
+    def load_result(self, data: dict) -> PromptRequest:
+        # kept requests replayed on resume are indexed, so the new ones are compared with them
+        request = super().load_result(data)
+        with self._lock:
+            self.__get_index(request).add(request.data[self._field])
+        return request
+
+    def __get_index(self, request: PromptRequest) -> MinHashIndex:
+        scope = (request.metadata.get('document_id'), request.metadata.get('section')) \
+            if self._per_section else None
+        return self._indexes.setdefault(scope, MinHashIndex())
+
+    def get_planned_prompts(self, requests: list[PromptRequest]) -> list[tuple[str, str, GenerationConfig]]:
+        return []
+
+    def on_stage_finished(self):
+        with self._lock:
+            dropped_requests = self._dropped_requests
+            self._dropped_requests = []
+            self._indexes = {}
+        self._count(dropped=len(dropped_requests))
+        self._logger.info(
+            f"Dropped {len(dropped_requests)} near-duplicate {self._field}(s)")
+        if len(dropped_requests) > 0:
+            self.save_checkpoint(dropped_requests, suffix='__dropped')
+
+    def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
+        return [request]
@@ -0,0 +1,149 @@
+import math
+from dataclasses import dataclass
+from typing import Callable
+from utils.metrics import MetricsRecorder
+from . import PromptRequest, PromptHandler, PromptValidationRequest
+
+# Typical length in characters of the generated fields, used to fill the sample
+# responses. Strings without a property name are the extracted topics.
+SAMPLE_LENGTHS = {None: 42, 'question': 60, 'answer': 156, 'reason': 240}
+
+
+def sample_response(schema: dict, document: str, name: str = None):
+    """Response with as many items as the JSON schema allows, its strings taken from the document."""
+    if schema is None:
+        return None
+    match schema.get('type'):
+        case 'array':
+            return [sample_response(schema['items'], document, name)
+                    for _ in range(schema.get('maxItems', schema.get('minItems', 1)))]
+        case 'object':
+            return {key: sample_response(value, document, key)
+                    for key, value in schema.get('properties', {}).items()}
+        case 'number' | 'integer':
+            return 1
+        case 'boolean':
+            return True
+        case _:
+            length = SAMPLE_LENGTHS.get(name, SAMPLE_LENGTHS[None])
+            return document[:length].rsplit(' ', 1)[0] if len(document) > length else document
+
+
+@dataclass
+class StagePlan:
+    stage: str
+    model: str
+    # whether the rates of the stage come from previous runs or from its configuration
+    from_history: bool = False
+    requests: float = 0
+    prompts: float = 0
+    prompt_tokens: float = 0
+    completion_tokens: float = 0
+    results: float = 0
+
+    def gpu_hours(self, prefill_rate: float, decode_rate: float) -> float:
+        """GPU time of the stage at the given prefill and decode throughputs, in tokens per second."""
+        return (self.prompt_tokens / prefill_rate + self.completion_tokens / decode_rate) / 3600
+
+
+class RunPlanner:
+    """Projects the requests, prompts and tokens of each stage of a handler chain
+    without calling the models. The prompts are formatted from sample requests
+    built by each stage out of a response with as many items as its JSON schema
+    allows. The requests passed on, the retries, the pre-filter decisions and the
+    completion tokens come from the metrics of previous runs of the stage on the
+    same model when available; otherwise every item is assumed to pass and every
+    completion to use 'max_tokens', so the estimate is an upper bound."""
+
+    def __init__(self, count_tokens: Callable[[str], int], history: MetricsRecorder = None) -> None:
+        self._count_tokens = count_tokens
+        self._history = history.summary() if history else {}
+        self._system_prompt_tokens = {}
+
+    def plan(self, handler: PromptHandler, requests: list[PromptRequest]) -> list[StagePlan]:
+        handlers = []
+        while handler:
+            handlers.append(handler)
+            handler = handler._next_handler
+        plans = []
+        for handler in handlers:
+            key = (handler.get_prompt_template().name, handler._model.model_name)
+            plans.append(StagePlan(*key, from_history=key in self._history))
+
+        for request in requests:
+            document = request.resolve()['document']
+            samples, count = [request], 1.0
+            for handler, plan in zip(handlers, plans):
+                if count == 0 or len(samples) == 0:
+                    break
+                samples, count = self.__plan_stage(handler, plan, samples, count, document)
+        return plans
+
+    def __plan_stage(self, handler: PromptHandler, plan: StagePlan, samples: list[PromptRequest],
+                     count: float, document: str) -> tuple[list[PromptRequest], float]:
+        history = self._history.get((plan.stage, plan.model))
+        first_attempts = history['size'] - history['retries'] if history else 0
+        plan.requests += count
+
+        sent_count = count
+        retry_factor = 1.0
+        if first_attempts > 0:
+            if getattr(handler, 'prefilter', None) is not None:
+                decided = history['prefilter_accepted'] + history['prefilter_rejected']
+                sent_count *= 1 - decided / first_attempts
+            retry_factor = history['size'] / first_attempts
+
+        if sent_count > 0:
+            # the samples are repeated up to the projected count, so stages grouping
+            # the requests of a section plan the same prompts as a run would
+            repeated = [samples[i % len(samples)] for i in range(max(round(sent_count), 1))]
+            scale = sent_count / len(repeated) * retry_factor
+            for system_prompt, user_prompt, config in handler.get_planned_prompts(repeated):
+                plan.prompts += scale
+                plan.prompt_tokens += (self.__count_system_prompt(system_prompt)
+                                       + self._count_tokens(user_prompt)) * scale
+                plan.completion_tokens += self.__get_completion_tokens(history, config.max_tokens) * scale
+
+        response = sample_response(handler.get_json_schema(), document)
+        results = [result.request if isinstance(result, PromptValidationRequest) else result
+                   for sample in samples for result in handler.to_object(response, sample)]
+        if first_attempts > 0:
+            passed = history['passed'] if history['passed'] + history['rejected'] > 0 else history['results']
+            results_count = count * passed / first_attempts
+        else:
+            results_count = count * len(results) / len(samples)
+        plan.results += results_count
+        return results, results_count
+
+    def __get_completion_tokens(self, history, max_tokens: int) -> float:
+        generated = history['prompts'] - history['cache_hits'] if history else 0
+        if generated > 0 and history['completion_tokens'] > 0:
+            return history['completion_tokens'] / generated
+        return max_tokens
+
+    def __count_system_prompt(self, system_prompt: str) -> int:
+        if system_prompt not in self._system_prompt_tokens:
+            self._system_prompt_tokens[system_prompt] = self._count_tokens(system_prompt)
+        return self._system_prompt_tokens[system_prompt]
+
+
+def format_plan(plans: list[StagePlan], batch_size: int, prefill_rate: float, decode_rate: float,
+                gpu_cost_per_hour: float = None) -> str:
+    lines = [f"{'stage':<24}{'model':<28}{'requests':>10}{'batches':>8}{'prompts':>9}"
+             f"{'in tok':>12}{'out tok':>12}{'results':>10}{'GPU h':>8}  rates"]
+    for plan in plans:
+        lines.append(
+            f"{plan.stage:<24}{plan.model:<28}{plan.requests:>10.0f}{math.ceil(plan.requests / batch_size):>8}"
+            f"{plan.prompts:>9.0f}{plan.prompt_tokens:>12.0f}{plan.completion_tokens:>12.0f}"
+            f"{plan.results:>10.0f}{plan.gpu_hours(prefill_rate, decode_rate):>8.2f}"
+            f"  {'history' if plan.from_history else 'config'}")
+
+    gpu_hours = sum(plan.gpu_hours(prefill_rate, decode_rate) for plan in plans)
+    lines.append(
+        f"{'total':<52}{'':>10}{'':>8}{sum(plan.prompts for plan in plans):>9.0f}"
+        f"{sum(plan.prompt_tokens for plan in plans):>12.0f}"
+        f"{sum(plan.completion_tokens for plan in plans):>12.0f}{'':>10}{gpu_hours:>8.2f}")
+    if gpu_cost_per_hour is not None:
+        lines.append(f"Estimated cost: {gpu_hours * gpu_cost_per_hour:.2f} "
+                     f"at {gpu_cost_per_hour:.2f} per GPU-hour")
+    return '\n'.join(lines)
@@ -0,0 +1,98 @@
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from utils import normalize_text
+
+STOPWORDS = set("""
+a ao aos as ate com como da das de del dela dele deles do dos e ela elas ele eles em entre era essa esse
+esta estao este eu foi for ha isso isto ja la lhe mais mas me mesmo muito na nas nao nem no nos o os ou
+para pela pelas pelo pelos por porque pode qual quais quando que quem se sem ser seu seus sua suas sao
+sobre tambem tem ter um uma umas uns voce devo posso deve podem
+""".split())
+
+# Stems shorter than this are kept whole, longer words are truncated to it
+STEM_LENGTH = 6
+
+
+def tokenize(text: str) -> list[str]:
+    """Portuguese normalisation: lowercase without accents, no stopwords, plural
+    endings removed and words truncated to their first STEM_LENGTH characters."""
+    tokens = []
+    for word in re.findall(r'\w+', normalize_text(text)):
+        if word in STOPWORDS:
+            continue
+        word = re.sub(r'(oes|aes)$', 'ao', word) if len(word) > 4 else word
+        word = re.sub(r'(?<=[aeiou])s$', '', word) if len(word) > 3 else word
+        tokens.append(word[:STEM_LENGTH])
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 statistics of the sections, scoring how well the terms of a text are
+    covered by a section."""
+
+    def __init__(self, sections: list[str], k1: float = 1.2, b: float = 0.75) -> None:
+        self._k1 = k1
+        self._b = b
+        self._term_frequencies = {}
+        self._lock = threading.Lock()
+        document_frequencies = Counter()
+        total_length = 0
+        for section in sections:
+            term_frequencies = self.__get_term_frequencies(section)
+            document_frequencies.update(term_frequencies.keys())
+            total_length += sum(term_frequencies.values())
+        self._sections_count = max(len(sections), 1)
+        self._average_length = max(total_length / self._sections_count, 1)
+        self._idf = {term: self.__idf(frequency)
+                     for term, frequency in document_frequencies.items()}
+
+    def score(self, text: str, section: str) -> float:
+        """BM25 score of 'text' against 'section', relative to the score the section
+        would have if it had each term of the text once, capped at 1."""
+        terms = set(tokenize(text))
+        if len(terms) == 0:
+            return 0.0
+        term_frequencies = self.__get_term_frequencies(section)
+        length_norm = 1 - self._b + self._b * sum(term_frequencies.values()) / self._average_length
+
+        score = 0.0
+        max_score = 0.0
+        for term in terms:
+            idf = self._idf.get(term, self.__idf(0))
+            frequency = term_frequencies.get(term, 0)
+            score += idf * frequency * (self._k1 + 1) / (frequency + self._k1 * length_norm)
+            max_score += idf * (self._k1 + 1) / (1 + self._k1 * length_norm)
+        return min(score / max_score, 1.0)
+
+    def __idf(self, document_frequency: int) -> float:
+        return math.log(1 + (self._sections_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def __get_term_frequencies(self, section: str) -> Counter:
+        term_frequencies = self._term_frequencies.get(section)
+        if term_frequencies is None:
+            term_frequencies = Counter(tokenize(section))
+            with self._lock:
+                self._term_frequencies[section] = term_frequencies
+        return term_frequencies
+
+
+@dataclass
+class LexicalPrefilter:
+    """Decides the validations whose lexical score is at least 'accept_above' or
+    below 'reject_below', leaving the ones in between to the model. Rejection is
+    disabled by default, as paraphrased topics often share few terms with the document."""
+    index: LexicalIndex
+    accept_above: float = 0.9
+    reject_below: float = 0.0
+
+    def decide(self, text: str, section: str) -> tuple[bool, float]:
+        """Return whether the text is accepted, rejected or undecided (None), and its score."""
+        score = self.index.score(text, section)
+        if score >= self.accept_above:
+            return True, score
+        if score < self.reject_below:
+            return False, score
+        return None, score
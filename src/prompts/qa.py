@@ -1,8 +1,32 @@
 from models import IModel
-from . import PromptRequest, PromptTemplate, PromptHandler, PromptValidationHandler
+from . import PromptRequest, PromptTemplate, PromptHandler, PromptValidationHandler, PromptBatchValidationHandler
 import uuid
 
 
+def question_answer_schema(number_of_questions: int) -> dict:
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "question": {"type": "string"},
+                "answer": {"type": "string"}
+            },
+            "required": ["question", "answer"]
+        },
+        "minItems": 1,
+        "maxItems": number_of_questions
+    }
+
+
+def check_question_answers(json: dict | list):
+    """Raise when the response is not a list of objects with a question and an answer text."""
+    if not isinstance(json, list) or not all(
+            isinstance(qa, dict) and isinstance(qa.get('question'), str) and isinstance(qa.get('answer'), str)
+            for qa in json):
+        raise ValueError(f"Expected a list of questions and answers, got: {json}")
+
+
 class QuestionAnswerExtractionPrompt(PromptHandler):
     def __init__(self, model: IModel, number_of_questions: int = 5) -> None:
         super().__init__(model)
@@ -24,10 +48,10 @@ class QuestionAnswerExtractionPrompt(PromptHandler):
 
             examples:
 
-            Topic: Rolamentos dianteiros
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento.
             Em rolamentos dianteiros selados, nunca se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação
             entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Topic: Rolamentos dianteiros
             Answer:
             [
                 {{
@@ -40,13 +64,17 @@ class QuestionAnswerExtractionPrompt(PromptHandler):
                 }}
             ]""",
             user_prompt="""
-            Topic: {topic}
             Document: {document}
+            Topic: {topic}
             Answer:""",
             variables=['topic', 'document']
         )
 
+    def get_json_schema(self) -> dict:
+        return question_answer_schema(self.number_of_questions)
+
     def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
+        check_question_answers(json)
         return [request.update(data=dict(question=qa['question'], answer=qa['answer']), metadata=dict())
                 for qa in json]
 
@@ -105,7 +133,11 @@ class QuestionAnswerVariationsPrompt(PromptHandler):
             variables=['document', 'question', 'answer']
         )
 
+    def get_json_schema(self) -> dict:
+        return question_answer_schema(self.number_of_questions)
+
     def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
+        check_question_answers(json)
         requests = [request.update(data=dict(question=qa['question'], answer=qa['answer']), metadata=dict())
                     for qa in json]
         requests.append(request)
@@ -121,22 +153,25 @@ class QuestionsValidationPrompt(PromptValidationHandler):
 
             examples:
 
-            Question: Posso apertar a porca do rolamento ?
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Question: Posso apertar a porca do rolamento ?
             Answer: {"score": 0.8, "reason": "A pergunta aborda diretamente um tópico mencionado no documento, especificamente sobre apertar a porca do rolamento, indicando relevância. No entanto, não se alinha totalmente com o contexto, pois o documento principalmente alerta contra o aperto excessivo e discute possíveis problemas relacionados à lubrificação e diferentes composições químicas de graxa."}
-            Question: Devo substituir a graxa de rolamentos dianteiros selados ?
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Question: Devo substituir a graxa de rolamentos dianteiros selados ?
             Answer: {"score": 1.0, "reason": "A pergunta está diretamente relacionada ao conteúdo do documento, pois aborda a substituição da graxa em rolamentos dianteiros selados, o que é explicitamente mencionado no texto. Portanto, é altamente relevante e recebe uma pontuação máxima de 1.0."}
-            Question: Como funciona um motor a combustão ?
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Question: Como funciona um motor a combustão ?
             Answer: {"score": 0.0, "reason": "A pergunta não está relacionada ao conteúdo do documento. O documento trata sobre a importância de não apertar excessivamente a porca do rolamento e os problemas associados à substituição da graxa em rolamentos dianteiros selados. Não aborda o funcionamento de um motor a combustão, portanto, a pergunta é considerada irrelevante para este documento, recebendo uma pontuação de 0.0."}""",
             user_prompt="""
-            Question: {question}
             Document: {document}
+            Question: {question}
             Answer:""",
             variables=['question', 'document']
         )
 
+    def get_prefilter_text(self, request: PromptRequest) -> str:
+        return request.data['question']
+
 
 class AnswerValidationPrompt(PromptValidationHandler):
     def get_prompt_template(self) -> PromptTemplate:
@@ -147,27 +182,85 @@ class AnswerValidationPrompt(PromptValidationHandler):
 
             examples:
 
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Question: Posso apertar a porca do rolamento ?
             Answer: O aperto excessivo da porca afeta diretamente a vida útil do rolamento.
-            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Response: {"score": 1.0, "reason": "A resposta aborda diretamente a questão, afirmando que o aperto excessivo da porca afeta a vida útil do rolamento, o que está alinhado perfeitamente com a preocupação de apertar a porca do rolamento."}
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Question: Devo substituir a graxa de rolamentos dianteiros selados ?
             Answer: Em rolamentos dianteiros selados, nunca substitua a graxa ou complete os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
-            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Response: {"score": 0.8, "reason": "Embora a resposta forneça uma recomendação clara de não substituir a graxa em rolamentos dianteiros selados, ela não responde diretamente à pergunta sobre se deve substituir a graxa. No entanto, a informação fornecida é relevante para a manutenção dos rolamentos dianteiros selados, o que contribui para uma pontuação alta."}
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Question: Como funciona um motor a combustão ?
             Answer: Os motores de combustão interna são máquinas térmicas que transformam a energia proveniente de uma reação química em energia mecânica.
-            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Response: {"score": 0.0, "reason": "A resposta não está relacionada ao funcionamento de um motor a combustão. Ela menciona a afetação da vida útil de um rolamento devido ao aperto excessivo da porca, o que não tem relevância para a pergunta sobre motores a combustão."}
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Question: Devo substituir a graxa de rolamentos dianteiros selados ?
             Answer: Em rolamentos dianteiros selados, substitua a graxa e complete os espaços internos, porque não existe risco de uma reação entre as graxas com composições químicas diferentes.
-            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
             Response: {"score": 0.0, "reason": "A resposta contradiz diretamente o conteúdo do documento, que recomenda não substituir a graxa em rolamentos dianteiros selados devido ao risco de reação entre diferentes composições químicas. Portanto, a resposta é considerada incorreta."}
             """,
             user_prompt="""
+            Document: {document}
             Question: {question}
             Answer: {answer}
-            Document: {document}
             Response:""",
             variables=['question', 'answer', 'document']
         )
+
+    def get_prefilter_text(self, request: PromptRequest) -> str:
+        return request.data['answer']
+
+
+class QuestionsBatchValidationPrompt(PromptBatchValidationHandler, QuestionsValidationPrompt):
+    def get_batch_prompt_template(self) -> PromptTemplate:
+        return PromptTemplate(
+            name="questions_batch_validation",
+            system_prompt="""
+            Given a document and a numbered list of questions, classify the relevance of each question in relation to the document with a score between 0 and 1.0 and a reason for the score, considering 1.0 as a very relevant question and 0 as an irrelevant question. Your output should be a JSON array with one object for each question, in the same order of the list, representing the score and the reason. Each object should have the fields "score" and "reason" where "score" is a float and "reason" is a string.
+
+            examples:
+
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Questions:
+            1. Question: Posso apertar a porca do rolamento ?
+            2. Question: Devo substituir a graxa de rolamentos dianteiros selados ?
+            3. Question: Como funciona um motor a combustão ?
+            Answer: [{"score": 0.8, "reason": "A pergunta aborda diretamente um tópico mencionado no documento, especificamente sobre apertar a porca do rolamento, indicando relevância. No entanto, não se alinha totalmente com o contexto, pois o documento principalmente alerta contra o aperto excessivo e discute possíveis problemas relacionados à lubrificação e diferentes composições químicas de graxa."}, {"score": 1.0, "reason": "A pergunta está diretamente relacionada ao conteúdo do documento, pois aborda a substituição da graxa em rolamentos dianteiros selados, o que é explicitamente mencionado no texto. Portanto, é altamente relevante e recebe uma pontuação máxima de 1.0."}, {"score": 0.0, "reason": "A pergunta não está relacionada ao conteúdo do documento. O documento trata sobre a importância de não apertar excessivamente a porca do rolamento e os problemas associados à substituição da graxa em rolamentos dianteiros selados. Não aborda o funcionamento de um motor a combustão, portanto, a pergunta é considerada irrelevante para este documento, recebendo uma pontuação de 0.0."}]""",
+            user_prompt="""
+            Document: {document}
+            Questions:
+            {items}
+            Answer:""",
+            variables=['document', 'items']
+        )
+
+    def format_item(self, request: PromptRequest) -> str:
+        return f"Question: {request.data['question']}"
+
+
+class AnswerBatchValidationPrompt(PromptBatchValidationHandler, AnswerValidationPrompt):
+    def get_batch_prompt_template(self) -> PromptTemplate:
+        return PromptTemplate(
+            name="answers_batch_validation",
+            system_prompt="""
+            Given a document and a numbered list of questions and answers, using knowledge of the document classify whether each question is being answered correctly. The classification will be with a score between 0 and 1.0 and a justification for this score, considering 1.0 as a completely correct answer and 0 as a completely wrong answer. Your output should be a JSON array with one object for each question and answer, in the same order of the list, representing the score and reason. Each object should have the fields “score” and “reason” where “score” is a float and “reason” is a string.
+
+            examples:
+
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Questions and answers:
+            1. Question: Posso apertar a porca do rolamento ? Answer: O aperto excessivo da porca afeta diretamente a vida útil do rolamento.
+            2. Question: Como funciona um motor a combustão ? Answer: Os motores de combustão interna são máquinas térmicas que transformam a energia proveniente de uma reação química em energia mecânica.
+            3. Question: Devo substituir a graxa de rolamentos dianteiros selados ? Answer: Em rolamentos dianteiros selados, substitua a graxa e complete os espaços internos, porque não existe risco de uma reação entre as graxas com composições químicas diferentes.
+            Response: [{"score": 1.0, "reason": "A resposta aborda diretamente a questão, afirmando que o aperto excessivo da porca afeta a vida útil do rolamento, o que está alinhado perfeitamente com a preocupação de apertar a porca do rolamento."}, {"score": 0.0, "reason": "A resposta não está relacionada ao funcionamento de um motor a combustão. Ela menciona a afetação da vida útil de um rolamento devido ao aperto excessivo da porca, o que não tem relevância para a pergunta sobre motores a combustão."}, {"score": 0.0, "reason": "A resposta contradiz diretamente o conteúdo do documento, que recomenda não substituir a graxa em rolamentos dianteiros selados devido ao risco de reação entre diferentes composições químicas. Portanto, a resposta é considerada incorreta."}]
+            """,
+            user_prompt="""
+            Document: {document}
+            Questions and answers:
+            {items}
+            Response:""",
+            variables=['document', 'items']
+        )
+
+    def format_item(self, request: PromptRequest) -> str:
+        return f"Question: {request.data['question']} Answer: {request.data['answer']}"
@@ -0,0 +1,158 @@
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+
+
+@dataclass
+class ScheduledRequest:
+    request: Any
+    sequence: int
+    tokens: int = 0
+    attempts: int = 0
+    enqueued_at: float = 0.0
+
+
+class RequestScheduler:
+    """Work queue that dispatches requests in batches of up to 'batch_size'
+    requests and 'max_batch_tokens' prompt tokens.
+    Requests are grouped with others of the same 'group_key' and then of similar
+    prompt length, looking ahead 'lookahead' batches in the queue. Failed requests are put back in the queue
+    and ride along with the next batch instead of being retried right away in a
+    nearly empty batch.
+    'generate' receives a Counter to add its own metrics of the batch to, which are
+    handed over to 'on_batch' with the size, queue wait and latency of the batch."""
+
+    def __init__(self, generate: Callable[[list, Counter], tuple[list, list]], batch_size: int, max_in_flight: int = 1,
+                 max_retries: int = 10, retry_budget: int = None,
+                 resume: Callable[[list], tuple[list, list]] = None,
+                 count_tokens: Callable[[Any], int] = None, max_batch_tokens: int = None,
+                 group_key: Callable[[Any], Any] = None, lookahead: int = 2,
+                 on_batch: Callable[[Counter, list], None] = None) -> None:
+        self._generate = generate
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+        self._retry_budget = retry_budget
+        self._resume = resume
+        self._count_tokens = count_tokens
+        self._max_batch_tokens = max_batch_tokens
+        self._group_key = group_key
+        self._on_batch = on_batch
+        self._window_size = batch_size * lookahead if count_tokens else batch_size
+        self._sequence = 0
+        self.requests_count = 0
+        self.retries_count = 0
+        self.failed_requests = []
+
+    def run(self, requests: Iterable) -> Iterator[tuple[int, list]]:
+        """Yield the number of requests completed and the successful results of each batch."""
+        source = iter(requests)
+        pending = []
+        in_flight = deque()
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=self._max_in_flight) as executor:
+            while True:
+                while len(in_flight) < self._max_in_flight:
+                    while not exhausted and len(pending) < self._window_size:
+                        exhausted, resumed_count, resumed_results = self.__fill(
+                            source, pending)
+                        if resumed_count > 0:
+                            yield resumed_count, resumed_results
+                    if len(pending) == 0:
+                        break
+                    batch, full = self.__select_batch(pending)
+                    # Wait for in flight batches so their failures fill up the last batches
+                    if not full and len(in_flight) > 0:
+                        break
+                    selected = set(id(scheduled) for scheduled in batch)
+                    pending[:] = [scheduled for scheduled in pending
+                                  if id(scheduled) not in selected]
+                    future = executor.submit(self.__generate, batch)
+                    in_flight.append((batch, future))
+
+                if len(in_flight) == 0:
+                    return
+
+                batch, future = in_flight.popleft()
+                successful_results, failed_requests, metrics = future.result()
+                requeued_count = self.__requeue(
+                    batch, failed_requests, pending)
+                if self._on_batch:
+                    metrics.update(results=len(successful_results), retries=requeued_count,
+                                   errors=len(failed_requests) - requeued_count)
+                    self._on_batch(metrics, successful_results)
+                yield len(batch) - requeued_count, successful_results
+
+    def __generate(self, batch: list[ScheduledRequest]) -> tuple[list, list, Counter]:
+        start = time.monotonic()
+        metrics = Counter(size=len(batch), tokens=sum(scheduled.tokens for scheduled in batch),
+                          queue_wait=sum(start - scheduled.enqueued_at for scheduled in batch) / len(batch))
+        successful_results, failed_requests = self._generate(
+            [scheduled.request for scheduled in batch], metrics)
+        metrics.update(latency=time.monotonic() - start)
+        return successful_results, failed_requests, metrics
+
+    def __fill(self, source: Iterator, pending: list) -> tuple[bool, int, list]:
+        missing_count = self._window_size - len(pending)
+        requests = list(islice(source, missing_count))
+        exhausted = len(requests) < missing_count
+
+        resumed_results = []
+        resumed_count = 0
+        if self._resume and len(requests) > 0:
+            pending_requests, resumed_results = self._resume(requests)
+            resumed_count = len(requests) - len(pending_requests)
+            requests = pending_requests
+
+        self.requests_count += len(requests)
+        for request in requests:
+            tokens = self._count_tokens(request) if self._count_tokens else 0
+            pending.append(ScheduledRequest(
+                request, self._sequence, tokens, enqueued_at=time.monotonic()))
+            self._sequence += 1
+        return exhausted, resumed_count, resumed_results
+
+    def __select_batch(self, pending: list[ScheduledRequest]) -> tuple[list[ScheduledRequest], bool]:
+        """Select the oldest pending request, the others of its group and then the
+        ones closest to its length, returning whether the batch is full."""
+        anchor = min(pending, key=lambda scheduled: scheduled.sequence)
+        anchor_group = self.__get_group(anchor)
+        candidates = sorted(pending, key=lambda scheduled: (
+            self.__get_group(scheduled) != anchor_group,
+            abs(scheduled.tokens - anchor.tokens),
+            scheduled.sequence))
+
+        batch = []
+        batch_tokens = 0
+        for candidate in candidates:
+            if len(batch) == self._batch_size:
+                return batch, True
+            if self._max_batch_tokens and len(batch) > 0 and \
+                    batch_tokens + candidate.tokens > self._max_batch_tokens:
+                return batch, True
+            batch.append(candidate)
+            batch_tokens += candidate.tokens
+        return batch, len(batch) == self._batch_size
+
+    def __get_group(self, scheduled: ScheduledRequest):
+        return self._group_key(scheduled.request) if self._group_key else None
+
+    def __requeue(self, batch: list[ScheduledRequest], failed_requests: list, pending: list) -> int:
+        scheduled_requests = {id(scheduled.request): scheduled
+                              for scheduled in batch}
+        requeued_count = 0
+        for failed_request in failed_requests:
+            scheduled = scheduled_requests[id(failed_request.request)]
+            scheduled.attempts += 1
+            within_budget = self._retry_budget is None or self.retries_count < self._retry_budget
+            if scheduled.attempts < self._max_retries and within_budget:
+                scheduled.enqueued_at = time.monotonic()
+                pending.append(scheduled)
+                self.retries_count += 1
+                requeued_count += 1
+            else:
+                self.failed_requests.append(failed_request)
+        return requeued_count
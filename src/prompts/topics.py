@@ -1,5 +1,5 @@
-from models import IModel
-from . import PromptRequest, PromptTemplate, PromptHandler, PromptValidationHandler
+from models import IModel, GenerationConfig
+from . import PromptRequest, PromptTemplate, PromptHandler, PromptValidationHandler, PromptBatchValidationHandler
 
 
 class TopicsExtractionPrompt(PromptHandler):
@@ -32,7 +32,20 @@ class TopicsExtractionPrompt(PromptHandler):
             variables=['document']
         )
 
+    def get_generation_config(self) -> GenerationConfig:
+        return GenerationConfig(max_tokens=512, stop=[']'])
+
+    def get_json_schema(self) -> dict:
+        return {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+            "maxItems": self._number_of_topics
+        }
+
     def to_object(self, json: dict | list, request: PromptRequest) -> list[PromptRequest]:
+        if not isinstance(json, list) or not all(isinstance(topic, str) for topic in json):
+            raise ValueError(f"Expected a list of topics, got: {json}")
         return [request.update(data=dict(topic=topic), metadata=dict()) for topic in json]
 
 
@@ -45,18 +58,48 @@ class TopicsValidationPrompt(PromptValidationHandler):
 
             examples:
 
-            Topic: Prevenção de reações químicas entre diferentes tipos de graxa
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Topic: Prevenção de reações químicas entre diferentes tipos de graxa
             Answer: {"score": 0.8, "reason": "O documento discute as potenciais consequências de misturar diferentes tipos de graxa em rolamentos, indicando uma relevância significativa para o tópico de prevenir reações químicas entre diferentes tipos de graxa."}
-            Topic: Impacto do aperto excessivo da porca na vida útil do rolamento
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Topic: Impacto do aperto excessivo da porca na vida útil do rolamento
             Answer: {"score": 1.0, "reason": "O documento aborda diretamente o impacto do aperto excessivo da porca na vida útil do rolamento, confirmando uma relação muito forte com o tópico proposto."}
-            Topic: Funções e tipos de válvulas de motor
             Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Topic: Funções e tipos de válvulas de motor
             Answer: {"score": 0, "reason": "O documento não aborda funções ou tipos de válvulas de motor; portanto, não há relevância para o tópico proposto."}""",
             user_prompt="""
-            Topic: {topic}
             Document: {document}
+            Topic: {topic}
             Answer:""",
             variables=['topic', 'document']
         )
+
+    def get_prefilter_text(self, request: PromptRequest) -> str:
+        return request.data['topic']
+
+
+class TopicsBatchValidationPrompt(PromptBatchValidationHandler, TopicsValidationPrompt):
+    def get_batch_prompt_template(self) -> PromptTemplate:
+        return PromptTemplate(
+            name="topics_batch_validation",
+            system_prompt="""
+            Given a document and a numbered list of topics, classify the relevance of each topic in relation to the document with a score between 0 and 1.0 and a reason for the score, considering 1.0 as a very relevant topic and 0 as an irrelevant topic. Your output should be a JSON array with one object for each topic, in the same order of the list, representing the score and the reason. Each object should have the fields "score" and "reason" where "score" is a float and "reason" is a string.
+
+            examples:
+
+            Document: O aperto excessivo da porca afeta diretamente a vida útil do rolamento. Em rolamentos dianteiros selados, não se deve substituir a graxa ou completar os espaços internos, porque pode haver uma reação entre as graxas com composições químicas diferentes, além de um aquecimento elevado no interior do rolamento.
+            Topics:
+            1. Topic: Prevenção de reações químicas entre diferentes tipos de graxa
+            2. Topic: Impacto do aperto excessivo da porca na vida útil do rolamento
+            3. Topic: Funções e tipos de válvulas de motor
+            Answer: [{"score": 0.8, "reason": "O documento discute as potenciais consequências de misturar diferentes tipos de graxa em rolamentos, indicando uma relevância significativa para o tópico de prevenir reações químicas entre diferentes tipos de graxa."}, {"score": 1.0, "reason": "O documento aborda diretamente o impacto do aperto excessivo da porca na vida útil do rolamento, confirmando uma relação muito forte com o tópico proposto."}, {"score": 0, "reason": "O documento não aborda funções ou tipos de válvulas de motor; portanto, não há relevância para o tópico proposto."}]""",
+            user_prompt="""
+            Document: {document}
+            Topics:
+            {items}
+            Answer:""",
+            variables=['document', 'items']
+        )
+
+    def format_item(self, request: PromptRequest) -> str:
+        return f"Topic: {request.data['topic']}"
@@ -1,21 +1,84 @@
 import json
 import os
+import dataclasses
 from typing import Any
 import logging
+import re
 import sys
+import threading
+import unicodedata
+from collections import Counter
+from queue import Queue
+from typing import Iterable, Iterator
 
 
-def load_json(s: str) -> Any:
-    return json.loads(s.replace('\n', ' '), strict=False)
+def load_json(s: str, repairs: Counter = None) -> Any:
+    """Parse a model response, repairing common defects when it is not valid JSON.
+    Each repair applied is counted in 'repairs'."""
+    s = s.replace('\n', ' ')
+    try:
+        return json.loads(s, strict=False)
+    except json.JSONDecodeError as error:
+        parse_error = error
 
+    applied_repairs = []
+    fenced = re.search(r'```(?:json)?(.*?)(?:```|$)', s, re.DOTALL)
+    if fenced:
+        s = fenced.group(1).strip()
+        applied_repairs.append('code_fence')
 
-def save_json(file: str, data: list[object], append=False):
-    if (append and os.path.isfile(file)):
-        data.extend(read_json(file))
+    without_trailing_commas = re.sub(r',\s*([\]}])', r'\1', s)
+    if without_trailing_commas != s:
+        s = without_trailing_commas
+        applied_repairs.append('trailing_comma')
 
+    start = min((i for i in (s.find('['), s.find('{')) if i >= 0), default=-1)
+    if start < 0:
+        raise parse_error
+
+    decoder = json.JSONDecoder(strict=False)
+    try:
+        obj, end = decoder.raw_decode(s, start)
+        if start > 0 or len(s[end:].strip()) > 0:
+            applied_repairs.append('surrounding_text')
+    except json.JSONDecodeError:
+        if s[start] != '[':
+            raise parse_error
+        obj = _decode_array_prefix(decoder, s, start)
+        if len(obj) == 0:
+            raise parse_error
+        applied_repairs.append('truncated_array')
+
+    if repairs is not None:
+        repairs.update(applied_repairs)
+    return obj
+
+
+def _decode_array_prefix(decoder: json.JSONDecoder, s: str, start: int) -> list:
+    items = []
+    position = start + 1
+    while True:
+        while position < len(s) and (s[position].isspace() or s[position] == ','):
+            position += 1
+        if position >= len(s) or s[position] == ']':
+            return items
+        try:
+            item, position = decoder.raw_decode(s, position)
+        except json.JSONDecodeError:
+            return items
+        items.append(item)
+
+
+def _to_json(obj: object) -> Any:
+    # dataclasses with __slots__ have no __dict__
+    if dataclasses.is_dataclass(obj):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+    return obj.__dict__
+
+
+def save_json(file: str, data: list[object]):
     with open(file, 'w', encoding='utf-8') as fp:
-        json.dump(data, fp, ensure_ascii=False,
-                  default=lambda obj: obj.__dict__)
+        json.dump(data, fp, ensure_ascii=False, default=_to_json)
 
 
 def read_json(file: str) -> Any:
@@ -23,10 +86,115 @@ def read_json(file: str) -> Any:
         return json.load(fp)
 
 
+class JsonlWriter:
+    """Appends records to a JSON Lines file, one flushed write per batch. The
+    file is only created on the first write, and a line left incomplete by an
+    interrupted run is discarded before appending."""
+
+    def __init__(self, file: str, append: bool = True) -> None:
+        self.file = file
+        self.count = 0
+        self._append = append
+        self._fp = None
+        self._lock = threading.Lock()
+
+    def write(self, records: Iterable[object]) -> None:
+        lines = ''.join(json.dumps(record, ensure_ascii=False, default=_to_json) + '\n'
+                        for record in records)
+        if len(lines) == 0:
+            return
+        with self._lock:
+            if self._fp is None:
+                self._fp = self.__open()
+            self._fp.write(lines)
+            self._fp.flush()
+            self.count += lines.count('\n')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fp is not None:
+                os.fsync(self._fp.fileno())
+                self._fp.close()
+                self._fp = None
+
+    def __open(self):
+        if not self._append or not os.path.isfile(self.file):
+            return open(self.file, 'w', encoding='utf-8')
+
+        with open(self.file, 'rb+') as fp:
+            content_end = fp.seek(0, os.SEEK_END)
+            while content_end > 0:
+                fp.seek(max(content_end - 4096, 0))
+                block = fp.read(content_end - fp.tell())
+                if b'\n' in block:
+                    content_end -= len(block) - block.rindex(b'\n') - 1
+                    break
+                content_end -= len(block)
+            fp.truncate(content_end)
+        return open(self.file, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_jsonl(file: str) -> Iterator[Any]:
+    """Stream the records of a JSON Lines file, skipping an incomplete last line."""
+    with open(file, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.endswith('\n'):
+                logging.getLogger(__name__).warning(
+                    f"Skipping incomplete record at the end of '{file}'")
+                return
+            if line.strip():
+                yield json.loads(line)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase the text and strip its accents, so 'Manutenção' and 'manutencao' match."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap estimate of the number of tokens of a text, about 3 characters per token."""
+    return len(text) // 3 + 1
+
+
 def chunker(seq: list, size: int):
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
 
+_END_OF_ITERATOR = object()
+
+
+class _PrefetchError:
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+def prefetch(iterable: Iterable, maxsize: int = 0) -> Iterator:
+    """Consume the iterable in a background thread, handing its items over through a queue."""
+    queue = Queue(maxsize)
+
+    def producer():
+        try:
+            for item in iterable:
+                queue.put(item)
+            queue.put(_END_OF_ITERATOR)
+        except BaseException as error:
+            queue.put(_PrefetchError(error))
+
+    threading.Thread(target=producer, daemon=True).start()
+
+    while (item := queue.get()) is not _END_OF_ITERATOR:
+        if isinstance(item, _PrefetchError):
+            raise item.error
+        yield item
+
+
 def config_log() -> logging.Logger:
     root = logging.getLogger()
     root.setLevel(logging.INFO)
@@ -0,0 +1,42 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class CheckpointStore:
+    """Durable store of the results produced for each request of a stage."""
+
+    def __init__(self, file: str) -> None:
+        Path(file).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    stage TEXT NOT NULL,
+                    request_key TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (stage, request_key))""")
+
+    def save(self, stage: str, results: dict[str, list[dict]]) -> None:
+        rows = [(stage, request_key, json.dumps(data, ensure_ascii=False, default=str))
+                for request_key, data in results.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results (stage, request_key, data) VALUES (?, ?, ?)", rows)
+
+    def load(self, stage: str, request_keys: list[str]) -> dict[str, list[dict]]:
+        results = {}
+        with self._lock:
+            for request_key in request_keys:
+                row = self._connection.execute(
+                    "SELECT data FROM results WHERE stage = ? AND request_key = ?",
+                    (stage, request_key)).fetchone()
+                if row:
+                    results[request_key] = json.loads(row[0])
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
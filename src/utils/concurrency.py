@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase/multiplicative decrease and
+    exponential back-off between failed calls."""
+
+    def __init__(self, max_in_flight: int, initial_delay: float = 0.5, max_delay: float = 30.0) -> None:
+        self._max_in_flight = max_in_flight
+        self._limit = max_in_flight
+        self._in_flight = 0
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._delay = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self) -> 'AdaptiveLimiter':
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+            delay = self._delay
+        if delay > 0:
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if exc_type is None:
+                self._limit = min(self._limit + 1, self._max_in_flight)
+                self._delay = 0.0
+            else:
+                self._limit = max(self._limit // 2, 1)
+                self._delay = min(max(self._delay * 2, self._initial_delay),
+                                  self._max_delay)
+            self._condition.notify_all()
@@ -3,6 +3,8 @@ SOURCE_DIR = './data/source'
 
 OUTPUT_DIR = './data/output'
 
+CACHE_DIR = f'{OUTPUT_DIR}/cache'
+
 SECTIONS_TO_IGNORE = [
     'TITLE',
     'CICLO OTTO',
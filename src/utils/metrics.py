@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import Counter
+from . import JsonlWriter, read_jsonl
+
+LATENCY_QUANTILES = [0.5, 0.95]
+
+
+class MetricsRecorder:
+    """Collects the metrics of each batch of the pipeline stages, appending them
+    to a JSON Lines file when 'file' is informed and aggregating them per stage
+    and model for the end of run summary and the Prometheus textfile."""
+
+    def __init__(self, file: str = None) -> None:
+        self._writer = JsonlWriter(file) if file else None
+        self._totals = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, files: list[str]) -> 'MetricsRecorder':
+        """Recorder with the batches of previous runs, read from their JSON Lines files."""
+        recorder = cls()
+        for file in files:
+            for record in read_jsonl(file):
+                record.pop('time', None)
+                recorder.record(record.pop('stage'), model=record.pop('model', None), **record)
+        return recorder
+
+    def record(self, stage: str, model: str = None, **metrics: float) -> None:
+        """Record the metrics of a batch of the stage, run on 'model'."""
+        if self._writer:
+            self._writer.write([dict(time=round(time.time(), 3), stage=stage, model=model, **metrics)])
+        with self._lock:
+            totals = self._totals.setdefault((stage, model), Counter())
+            totals.update(metrics)
+            totals.update(batches=1)
+            if 'latency' in metrics:
+                self._latencies.setdefault((stage, model), []).append(metrics['latency'])
+
+    def summary(self) -> dict[tuple[str, str], dict]:
+        """Totals of each stage and model along with the derived rates and latencies."""
+        summary = {}
+        with self._lock:
+            for key, totals in self._totals.items():
+                prompts = totals['prompts']
+                validations = totals['passed'] + totals['rejected']
+                batches = totals['batches']
+                # a Counter so the metrics a stage does not have read as zero
+                summary[key] = Counter(dict(
+                    totals,
+                    parse_failure_rate=self.__ratio(totals['parse_failures'], prompts),
+                    retry_rate=self.__ratio(totals['retries'], totals['size']),
+                    cache_hit_rate=self.__ratio(totals['cache_hits'], prompts),
+                    pass_rate=self.__ratio(totals['passed'], validations) if validations > 0 else None,
+                    mean_queue_wait=self.__ratio(totals['queue_wait'], batches),
+                    mean_latency=self.__ratio(totals['latency'], batches),
+                    **{f'p{int(q * 100)}_latency': self.__quantile(self._latencies.get(key, []), q)
+                       for q in LATENCY_QUANTILES}))
+        return summary
+
+    def model_summary(self) -> dict[str, Counter]:
+        """Prompts, tokens and generation time spent on each model."""
+        summary = {}
+        with self._lock:
+            for (stage, model), totals in self._totals.items():
+                if totals['prompts'] > 0:
+                    summary.setdefault(model, Counter()).update(
+                        prompts=totals['prompts'], prompt_tokens=totals['prompt_tokens'],
+                        completion_tokens=totals['completion_tokens'], generation_time=totals['latency'])
+        return summary
+
+    def format_summary(self) -> str:
+        lines = [f"{'stage':<24}{'model':<28}{'batches':>8}{'prompts':>9}{'in tok':>10}{'out tok':>10}"
+                 f"{'parse err':>10}{'retry':>8}{'cache':>8}{'pass':>8}{'wait s':>8}{'p50 s':>8}{'p95 s':>8}"]
+        for (stage, model), metrics in self.summary().items():
+            pass_rate = f"{metrics['pass_rate']:.1%}" if metrics['pass_rate'] is not None else '-'
+            lines.append(
+                f"{stage:<24}{str(model):<28}{metrics['batches']:>8}{metrics['prompts']:>9}"
+                f"{metrics['prompt_tokens']:>10}{metrics['completion_tokens']:>10}"
+                f"{metrics['parse_failure_rate']:>10.1%}{metrics['retry_rate']:>8.1%}"
+                f"{metrics['cache_hit_rate']:>8.1%}{pass_rate:>8}{metrics['mean_queue_wait']:>8.2f}"
+                f"{metrics['p50_latency']:>8.2f}{metrics['p95_latency']:>8.2f}")
+
+        lines.append('')
+        lines.append(f"{'model':<28}{'prompts':>9}{'in tok':>10}{'out tok':>10}{'gen s':>10}")
+        for model, metrics in self.model_summary().items():
+            lines.append(f"{str(model):<28}{metrics['prompts']:>9}{metrics['prompt_tokens']:>10}"
+                         f"{metrics['completion_tokens']:>10}{metrics['generation_time']:>10.1f}")
+        return '\n'.join(lines)
+
+    def write_prometheus(self, file: str, prefix: str = 'auto_qa') -> None:
+        """Write the totals of each stage in the Prometheus textfile format."""
+        with self._lock:
+            totals = {self.__get_labels(key): Counter(stage_totals) for key, stage_totals in self._totals.items()}
+            latencies = {self.__get_labels(key): list(values) for key, values in self._latencies.items()}
+
+        names = sorted(set(name for stage_totals in totals.values()
+                           for name in stage_totals if name not in ('latency', 'queue_wait')))
+        lines = []
+        for name in names:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.extend(f'{prefix}_{name}_total{{{labels}}} {stage_totals[name]}'
+                         for labels, stage_totals in totals.items())
+        for name in ('queue_wait', 'latency'):
+            lines.append(f'# TYPE {prefix}_batch_{name}_seconds summary')
+            for labels, stage_totals in totals.items():
+                if name == 'latency':
+                    lines.extend(f'{prefix}_batch_{name}_seconds{{{labels},quantile="{q}"}} '
+                                 f'{self.__quantile(latencies.get(labels, []), q):.6f}'
+                                 for q in LATENCY_QUANTILES)
+                lines.append(f'{prefix}_batch_{name}_seconds_sum{{{labels}}} {stage_totals[name]:.6f}')
+                lines.append(f'{prefix}_batch_{name}_seconds_count{{{labels}}} {stage_totals["batches"]}')
+
+        # written to a temporary file first, so collectors never read a partial file
+        with open(f'{file}.tmp', 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.replace(f'{file}.tmp', file)
+
+    def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+
+    def __get_labels(self, key: tuple[str, str]) -> str:
+        stage, model = key
+        return f'stage="{stage}",model="{model or ""}"'
+
+    def __ratio(self, value: float, total: float) -> float:
+        return value / total if total > 0 else 0.0
+
+    def __quantile(self, values: list[float], q: float) -> float:
+        if len(values) == 0:
+            return 0.0
+        values = sorted(values)
+        return values[min(int(q * len(values)), len(values) - 1)]